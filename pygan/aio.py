@@ -0,0 +1,204 @@
+import asyncio
+import os
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from math import ceil
+from time import perf_counter
+from typing import NamedTuple, Optional, Dict, List
+
+from pygan.algorithms.lca import get_lca
+from pygan.blast.sharding import compute_shards, parse_filter_range
+from pygan.database.batching import AdaptiveBatcher
+from pygan.database.bloom import BloomFilter
+from pygan.database.megan_map import connect, disconnect
+from pygan.lca_analysis import lookup_segments, flatten_accessions, get_batcher, batch_reads, \
+    post_process_assignments
+from pygan.storage.result import LcaResult
+from pygan.tree.phylo_tree import PhyloTree
+
+# bytes of blast data parsed, mapped and assigned per chunk
+CHUNK_BYTES = 1 << 26
+
+
+class StageEvent(NamedTuple):
+    """
+    Completion of a stage of one chunk of an analysis, post_process has a single chunk
+    """
+    stage: str
+    chunk: int
+    chunks: int
+    reads: int
+    seconds: float
+
+
+class Progress:
+    """
+    Async iterator of the stage events of an analysis
+
+    Iteration ends when the analysis completes, fails or is cancelled.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def report(self, stage: str, chunk: int, chunks: int, reads: int, start: float):
+        """
+        :param stage: 'parse', 'map', 'lca' or 'post_process'
+        :param chunk: index of the chunk
+        :param chunks: number of chunks
+        :param reads: number of reads of the chunk
+        :param start: perf_counter at the start of the stage
+        """
+        self._queue.put_nowait(StageEvent(stage, chunk, chunks, reads, perf_counter() - start))
+
+    def close(self):
+        """
+        End iteration after all reported events
+        """
+        self._queue.put_nowait(None)
+
+    def __aiter__(self) -> 'Progress':
+        return self
+
+    async def __anext__(self) -> StageEvent:
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+async def analyze(tree: PhyloTree, id2address: Dict, address2id: Dict, megan_map_file: str, blast_file: str,
+                  blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int, db_key: str,
+                  ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
+                  project_mode: str, project_rank: str, cluster_degree: int, keep_reads: bool = False,
+                  accession_filter: Optional[BloomFilter] = None, progress: Optional[Progress] = None,
+                  executor: Optional[Executor] = None, chunk_bytes: int = CHUNK_BYTES) -> LcaResult:
+    """
+    Performs the per-sample stages of an LCA analysis without blocking the event loop.
+
+    The blast file is processed in chunks of whole reads. Parsing, LCA assignment and post-processing run in
+    an executor, database lookups on a dedicated thread with its own connection. The prepared tree is not modified,
+    so any number of analyses can share it and run concurrently. Cancelling the awaiting task stops the analysis
+    before the next stage, a stage that already runs completes in the background and its result is discarded.
+
+    :param tree: phylogenetic tree
+    :param id2address: mapping of taxonomy id to its address in the tree
+    :param address2id: mapping of a tree address to its taxonomy id
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing continuous blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param keep_reads: keep read ids in the result, else only counts
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param progress: receives an event whenever a stage of a chunk completes and is closed at the end
+    :param executor: executor of parsing, LCA assignment and post-processing, the default executor of the loop if None
+    :param chunk_bytes: bytes of blast data per chunk
+    :return: result of the post-processed sample
+    """
+    loop = asyncio.get_running_loop()
+    keep_mapped_reads = project_mode in ('accession', 'mixed')
+    batcher = get_batcher(db_segment_size)
+    assignments: Dict[int, List[str]] = {}
+    mapped_reads = []
+    read_ids = []
+    # lookups of an analysis run one after another on the same thread and connection
+    db_executor = ThreadPoolExecutor(1)
+    connection = db_executor.submit(connect, megan_map_file)
+    try:
+        shards = max(1, ceil(os.path.getsize(blast_file) / chunk_bytes))
+        chunks = await loop.run_in_executor(executor, compute_shards, blast_file, shards, blast_map)
+        for i, (start, end) in enumerate(chunks):
+            t = perf_counter()
+            reads, chunk_read_ids = await loop.run_in_executor(executor, parse_filter_range, blast_file,
+                                                               top_score_percent, blast_map, start, end)
+            if progress:
+                progress.report('parse', i, len(chunks), len(reads), t)
+            t = perf_counter()
+            chunk_mapped_reads = await loop.run_in_executor(db_executor, map_chunk, reads, megan_map_file,
+                                                            db_segment_size, db_key, connection, accession_filter,
+                                                            batcher)
+            del reads
+            if progress:
+                progress.report('map', i, len(chunks), len(chunk_mapped_reads), t)
+            t = perf_counter()
+            await loop.run_in_executor(executor, assign_chunk, chunk_mapped_reads, chunk_read_ids, id2address,
+                                       address2id, ignore_ancestors, assignments)
+            if progress:
+                progress.report('lca', i, len(chunks), len(chunk_read_ids), t)
+            if keep_mapped_reads:
+                mapped_reads += chunk_mapped_reads
+                read_ids += chunk_read_ids
+        t = perf_counter()
+        result = await loop.run_in_executor(executor, post_process_assignments, tree, assignments, mapped_reads,
+                                            read_ids, min_support, only_major, exclude, project_mode, project_rank,
+                                            cluster_degree, keep_reads)
+        if progress:
+            progress.report('post_process', 0, 1, result.total, t)
+    finally:
+        # queued after any running lookup
+        db_executor.submit(close_connection, connection)
+        db_executor.shutdown(wait=False)
+        if progress:
+            progress.close()
+    return result
+
+
+def map_chunk(reads: List[List[str]], megan_map_file: str, db_segment_size: int, db_key: str,
+              connection: Future, accession_filter: Optional[BloomFilter] = None,
+              batcher: Optional[AdaptiveBatcher] = None) -> List[List[int]]:
+    """
+    Retrieve taxonomy ids for every read of a chunk from the Megan Map Database
+
+    :param reads: list of accessions per read
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: future of the connection of the database thread
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param batcher: sizes chunks by distinct accessions instead of db_segment_size
+    :return: list of taxonomy ids per read
+    """
+    mapped_reads = []
+    for grouped_reads, acc2id, _ in lookup_segments(batch_reads(reads, db_segment_size, batcher), flatten_accessions,
+                                                    megan_map_file, db_key, connection.result(), accession_filter,
+                                                    batcher=batcher):
+        for read in grouped_reads:
+            mapped_reads.append([acc2id[acc] for acc in read if acc in acc2id])
+    return mapped_reads
+
+
+def assign_chunk(mapped_reads: List[List[int]], read_ids: List[str], id2address: Dict, address2id: Dict,
+                 ignore_ancestors: bool, assignments: Dict[int, List[str]]):
+    """
+    Compute Lowest Common Ancestors of the reads of a chunk
+
+    :param mapped_reads: list of taxonomy ids per read
+    :param read_ids: list of read ids corresponding to reads
+    :param id2address: mapping of taxonomy id to its address in the tree
+    :param address2id: mapping of a tree address to its taxonomy id
+    :param ignore_ancestors: use longest address or shortest address as reference
+    :param assignments: read ids per assigned taxonomy id to add to
+    """
+    for read, read_id in zip(mapped_reads, read_ids):
+        tax_id = get_lca(read, id2address, address2id, ignore_ancestors)
+        if tax_id in assignments:
+            assignments[tax_id].append(read_id)
+        else:
+            assignments[tax_id] = [read_id]
+
+
+def close_connection(connection: Future):
+    """
+    :param connection: future of the connection of a database thread, nothing is closed if connecting failed
+    """
+    if connection.exception() is None:
+        disconnect(connection.result())
@@ -0,0 +1,48 @@
+from math import sqrt
+from statistics import NormalDist
+from typing import Dict, NamedTuple
+
+
+class Estimate(NamedTuple):
+    """
+    Estimated number of reads of a taxon in the whole sample
+    """
+    sampled: int
+    count: float
+    lower: float
+    upper: float
+
+
+def estimate_counts(counts: Dict[int, int], sampled: int, total: int, confidence: float = 0.95) \
+        -> Dict[int, Estimate]:
+    """
+    Scale read counts of a uniform random subsample of reads to the whole sample.
+
+    The share of every taxon gets a Wilson score interval, narrowed by the finite population correction,
+    as the subsample is drawn without replacement. Intervals are exact if every read was sampled.
+
+    :param counts: number of sampled reads per taxonomy id
+    :param sampled: number of sampled reads
+    :param total: number of reads in the sample
+    :param confidence: confidence level of the intervals in (0, 1)
+    :return: estimate per taxonomy id
+    """
+    if not sampled:
+        return {}
+    scale = total / sampled
+    if sampled >= total:
+        return {tax_id: Estimate(count, count * scale, count * scale, count * scale)
+                for tax_id, count in counts.items()}
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    # sampling without replacement carries as much information as a larger sample with replacement
+    effective = sampled * (total - 1) / (total - sampled)
+    z2 = z * z / effective
+    estimates = {}
+    for tax_id, count in counts.items():
+        share = count / sampled
+        denominator = 1 + z2
+        center = (share + z2 / 2) / denominator
+        margin = z * sqrt(share * (1 - share) / effective + z2 / (4 * effective)) / denominator
+        estimates[tax_id] = Estimate(count, share * total, max(0.0, center - margin) * total,
+                                     min(1.0, center + margin) * total)
+    return estimates
@@ -1,4 +1,5 @@
-from typing import List, Tuple, Dict
+from functools import lru_cache
+from typing import List, Tuple, Dict, Iterable
 
 from pygan.tree.phylo_tree import PhyloTree, PhyloNode
 
@@ -77,3 +78,75 @@ def get_common_prefix(addresses: List[Tuple], ignore_ancestors: bool = False) ->
     # if ancestors are to be ignored and all addresses are ancestors of reference
     # return reference
     return reference
+
+
+def get_lca(taxids: Iterable[int], id2address: Dict[int, Tuple], address2id: Dict[Tuple, int],
+            ignore_ancestors: bool = False) -> int:
+    """
+    Compute the lowest common ancestor of the taxons of a read
+
+    :param taxids: taxonomy ids of a read, ids missing in the tree are ignored
+    :param id2address: map of ids to addresses
+    :param address2id: map of addresses to ids
+    :param ignore_ancestors: use longest address or shortest address as reference
+    :return: taxonomy id of the lowest common ancestor
+    """
+    return address2id[get_common_prefix([
+        id2address[taxid] for taxid in taxids
+        if taxid in id2address
+    ], ignore_ancestors)]
+
+
+class LcaCache:
+    """
+    Bounded memo of lowest common ancestors keyed by the sorted, distinct taxonomy ids of a read
+
+    Reads that resolve to the same set of taxons cost one lookup instead of a prefix scan.
+    The least recently used sets are evicted first.
+    """
+
+    def __init__(self, id2address: Dict[int, Tuple], address2id: Dict[Tuple, int], maxsize: int = 1 << 16):
+        """
+        :param id2address: map of ids to addresses
+        :param address2id: map of addresses to ids
+        :param maxsize: maximum number of memoized sets of taxons
+        """
+        self.id2address = id2address
+        self.address2id = address2id
+        self._lookup = lru_cache(maxsize)(self._compute)
+
+    def _compute(self, taxids: Tuple[int, ...], ignore_ancestors: bool) -> int:
+        return get_lca(taxids, self.id2address, self.address2id, ignore_ancestors)
+
+    def get_lca(self, taxids: Iterable[int], ignore_ancestors: bool = False) -> int:
+        """
+        Compute the lowest common ancestor of the taxons of a read, see get_lca
+
+        :param taxids: taxonomy ids of a read, ids missing in the tree are ignored
+        :param ignore_ancestors: use longest address or shortest address as reference
+        :return: taxonomy id of the lowest common ancestor
+        """
+        return self._lookup(tuple(sorted(set(taxids))), ignore_ancestors)
+
+    @property
+    def hits(self) -> int:
+        return self._lookup.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self._lookup.cache_info().misses
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: share of reads answered from the memo, 0 if none were looked up
+        """
+        info = self._lookup.cache_info()
+        lookups = info.hits + info.misses
+        return info.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        """
+        Forget all memoized sets and statistics
+        """
+        self._lookup.cache_clear()
@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Set, Iterable
 from math import ceil
 
 from pygan.tree.phylo_tree import PhyloTree, PhyloNode
@@ -78,7 +78,8 @@ def proportional_down(node: PhyloNode):
         proportional_down(child)
 
 
-def project_accession(tree: PhyloTree, rank: str, reads: List[List[int]], read_ids: List[str], cluster_degree: int):
+def project_accession(tree: PhyloTree, rank: str, reads: Iterable[List[int]], read_ids: List[str],
+                      cluster_degree: int):
     """
     Project reads to a target rank by remapping them to lower level taxons according to their accessions
     or by pushing them upwards if they are below the target rank.
@@ -91,10 +92,32 @@ def project_accession(tree: PhyloTree, rank: str, reads: List[List[int]], read_i
     """
 
     accession_up(tree.root, rank, None)
-    read_map = {read_id: taxids for read_id, taxids in zip(read_ids, reads)}
+    # only reads above the target rank are remapped, keep taxons of those only
+    pending = set()
+    collect_above_rank(tree.root, rank, pending)
+    read_map = {read_id: taxids for read_id, taxids in zip(read_ids, reads) if read_id in pending}
     accession_down(tree.nodes, tree.root, rank, read_map, cluster_degree)
 
 
+def collect_above_rank(node: PhyloNode, rank: str, pending: Set[str]):
+    """
+    Collect ids of reads mapped to nodes above the target rank.
+
+    :param node: current node
+    :param rank: target rank to project reads to
+    :param pending: set to be filled with read ids
+    """
+
+    # terminate recursion at target rank
+    if node.rank == rank:
+        return
+    pending.update(node.reads)
+
+    # propagate
+    for child in node.children:
+        collect_above_rank(child, rank, pending)
+
+
 def accession_up(node: PhyloNode, rank: str, target: Optional[PhyloNode]):
     """
     Collect reads from nodes below the target rank.
@@ -255,7 +278,7 @@ def get_best_hit(clusters: Dict[PhyloNode, List[int]], hits: Dict[int, int]) ->
 
 
 def project_accession_proportional(tree: PhyloTree, rank: str,
-                                   reads: List[List[int]], read_ids: List[str], cluster_degree: int):
+                                   reads: Iterable[List[int]], read_ids: List[str], cluster_degree: int):
     """
     Project reads to a target rank by remapping them to lower level taxons according to their accessions
     or by pushing them upwards if they are below the target rank. Then project remaining reads proportionally.
@@ -0,0 +1,82 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from pygan.tree.phylo_tree import PhyloTree
+
+
+class SubtreeSummary:
+    """
+    Cumulative read counts of a phylogenetic tree
+
+    Takes the reads mapped to the tree once and stores their counts as prefix sums in preorder,
+    so the number of reads at or below any node is the difference of two prefix sums.
+    Later changes to the tree's reads are not reflected.
+    """
+
+    def __init__(self, tree: PhyloTree):
+        """
+        :param tree: phylogenetic tree with mapped reads, subtree intervals are computed if missing
+        """
+        if tree.preorder is None:
+            tree.compute_intervals()
+        self.tree = tree
+        counts = np.fromiter((len(node.reads) for node in tree.preorder), dtype=np.int64, count=len(tree.preorder))
+        self.prefix = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.prefix[1:])
+        self._ranks: Dict[str, List[int]] = {}
+
+    def at(self, tax_id: int) -> int:
+        """
+        :param tax_id: taxonomy id of a node
+        :return: number of reads mapped to the node itself
+        """
+        node = self.tree.nodes[tax_id]
+        return int(self.prefix[node.entry + 1] - self.prefix[node.entry])
+
+    def at_or_below(self, tax_id: int) -> int:
+        """
+        :param tax_id: taxonomy id of a node
+        :return: number of reads mapped to the node or any of its descendants
+        """
+        node = self.tree.nodes[tax_id]
+        return int(self.prefix[node.exit] - self.prefix[node.entry])
+
+    def cumulative_counts(self) -> Dict[int, int]:
+        """
+        :return: number of reads at or below every node with any
+        """
+        preorder = self.tree.preorder
+        entries = np.arange(len(preorder))
+        exits = np.fromiter((node.exit for node in preorder), dtype=np.int64, count=len(preorder))
+        cumulative = (self.prefix[exits] - self.prefix[entries]).tolist()
+        return {node.tax_id: count for node, count in zip(preorder, cumulative) if count}
+
+    def at_rank(self, rank: str) -> Dict[int, int]:
+        """
+        :param rank: rank such as 'genus'
+        :return: number of reads at or below every node of the rank with any
+        """
+        if rank not in self._ranks:
+            self._ranks[rank] = [node.tax_id for node in self.tree.preorder if node.rank == rank]
+        counts = {tax_id: self.at_or_below(tax_id) for tax_id in self._ranks[rank]}
+        return {tax_id: count for tax_id, count in counts.items() if count}
+
+    def rank_table(self, rank: str, show_path: bool = False, prefix_rank: bool = True) -> List[Tuple[str, int]]:
+        """
+        :param rank: rank such as 'genus'
+        :param show_path: name nodes by their path from root
+        :param prefix_rank: add an abbreviation of the rank to the name
+        :return: names and number of reads at or below every node of the rank with any, in descending order
+        """
+        nodes = self.tree.nodes
+        table = []
+        for tax_id, count in self.at_rank(rank).items():
+            node = nodes[tax_id]
+            if show_path:
+                name = node.path_with_rank if prefix_rank else node.path
+            else:
+                name = node.name_with_rank if prefix_rank else node.name
+            table.append((name, count))
+        table.sort(key=lambda row: row[1], reverse=True)
+        return table
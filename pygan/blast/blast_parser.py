@@ -1,7 +1,11 @@
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
+from pygan.blast.hit_limit import HitLimit
+from pygan.storage.spill import SpillList, SpillIds
 
-def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int]) -> Tuple[List[List[str]], List[str]]:
+
+def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int], memory_budget: int = 0,
+                 hit_limit: Optional[HitLimit] = None) -> Tuple[List[List[str]], List[str]]:
     """
     Read lines of file in tab format, extract reads containing accessions and bit scores.
     Filter accessions in each read by the top score percentage.
@@ -10,6 +14,8 @@ def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int]) -
     :param file: filepath
     :param top_score_percent: percentage in [0, 1] to filter accessions by
     :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_budget: maximum number of accessions and read ids held in memory before spilling to disk, 0 to disable
+    :param hit_limit: limits hits per read before the top score filter
     :return: list of accessions per read filtered by top score percentage, list of read ids
     """
 
@@ -17,8 +23,8 @@ def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int]) -
     sseqid = tab_map['sseqid']
     bitscore = tab_map['bitscore']
 
-    reads = []
-    read_ids = []
+    reads = SpillList(memory_budget) if memory_budget else []
+    read_ids = SpillIds(memory_budget) if memory_budget else []
     read = None
     read_id = None
 
@@ -34,7 +40,7 @@ def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int]) -
             # new read
             if next_id != read_id:
                 # flush last read
-                reads.append(filter_by_top_score(read, top_score_percent))
+                reads.append(filter_by_top_score(hit_limit.apply(read) if hit_limit else read, top_score_percent))
                 read_ids.append(read_id)
                 read = []
                 read_id = next_id
@@ -45,7 +51,7 @@ def parse_filter(file: str, top_score_percent: float, tab_map: Dict[str, int]) -
             # iterate
             line = f.readline()
         # flush last read
-        reads.append(filter_by_top_score(read, top_score_percent))
+        reads.append(filter_by_top_score(hit_limit.apply(read) if hit_limit else read, top_score_percent))
         read_ids.append(read_id)
 
     return reads, read_ids
@@ -72,7 +78,8 @@ def filter_by_top_score(read: List[Tuple[str, float]], top_score_percent: float)
     return [accession for accession, score in read if not score < bound]
 
 
-def parse_with_score(file: str, tab_map: Dict[str, int]) -> Tuple[List[List[Tuple[str, float]]], List[str]]:
+def parse_with_score(file: str, tab_map: Dict[str, int], hit_limit: Optional[HitLimit] = None) \
+        -> Tuple[List[List[Tuple[str, float]]], List[str]]:
     """
     Read lines of file in tab format, extract reads containing accessions and bit scores.
     Filter accessions in each read by the top score percentage.
@@ -81,6 +88,7 @@ def parse_with_score(file: str, tab_map: Dict[str, int]) -> Tuple[List[List[Tupl
     :param file: filepath
     :param top_score_percent: percentage in [0, 1] to filter accessions by
     :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param hit_limit: limits hits per read
     :return: list of accessions per read filtered by top score percentage, list of read ids
     """
 
@@ -105,7 +113,7 @@ def parse_with_score(file: str, tab_map: Dict[str, int]) -> Tuple[List[List[Tupl
             # new read
             if next_id != read_id:
                 # flush last read
-                reads.append(read)
+                reads.append(hit_limit.apply(read) if hit_limit else read)
                 read_ids.append(read_id)
                 read = []
                 read_id = next_id
@@ -116,7 +124,7 @@ def parse_with_score(file: str, tab_map: Dict[str, int]) -> Tuple[List[List[Tupl
             # iterate
             line = f.readline()
         # flush last read
-        reads.append(read)
+        reads.append(hit_limit.apply(read) if hit_limit else read)
         read_ids.append(read_id)
 
     return reads, read_ids
@@ -0,0 +1,181 @@
+import mmap
+import os
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+
+from pygan.blast.hit_limit import HitLimit
+from pygan.blast.score_array import ScoreArray, filter_score_array, limit_score_array
+
+# number of bytes of lines whose columns are gathered at once
+BLOCK_SIZE = 1 << 22
+TAB = ord('\t')
+NEWLINE = ord('\n')
+
+
+def parse_score_array_mmap(file: str, tab_map: Dict[str, int]) -> Tuple[ScoreArray, List[str]]:
+    """
+    Memory map a file in tab format and extract reads containing accessions and bit scores.
+    Blocks of lines are viewed as bytes without copying, the separators of a block are found at once
+    and only the required columns are gathered. Bit scores are converted and reads are delimited in bulk,
+    only read ids are decoded. Assumes that reads are continuous.
+
+    :param file: filepath
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: encoded accessions with scores and offsets per read, list of read ids
+    """
+
+    accessions = []
+    scores = []
+    starts = []
+    read_ids = []
+    hits = 0
+    last_id = None
+
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ScoreArray(np.zeros(0, dtype='S1'), np.zeros(0, dtype=np.float64), np.zeros(1, dtype=np.int64)), []
+        # the map is closed once the arrays viewing it are released
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = np.frombuffer(mm, dtype=np.uint8)
+    # all lines are expected to have as many columns as the first one
+    first = mm.find(b'\n')
+    columns = mm[:first if first >= 0 else size].count(b'\t') + 1
+    start = 0
+    while start < size:
+        # cut blocks after their last complete line
+        end = min(start + BLOCK_SIZE, size)
+        if end < size:
+            cut = mm.rfind(b'\n', start, end)
+            if cut < start:
+                # a single line longer than a block
+                cut = mm.find(b'\n', end)
+            end = cut + 1 if cut >= 0 else size
+        block_ids, block_accessions, block_scores = split_block(data[start:end], columns, tab_map)
+        # reads start where the read id changes, also across blocks
+        new_read = np.empty(len(block_ids), dtype=bool)
+        if len(block_ids):
+            new_read[0] = block_ids[0] != last_id
+            np.not_equal(block_ids[1:], block_ids[:-1], out=new_read[1:])
+            last_id = block_ids[-1]
+        block_starts = np.flatnonzero(new_read)
+        read_ids += decode(block_ids[block_starts])
+        starts.append(block_starts + hits)
+        accessions.append(block_accessions)
+        scores.append(block_scores)
+        hits += len(block_ids)
+        start = end
+
+    offsets = np.append(np.concatenate(starts), hits).astype(np.int64)
+    return ScoreArray(np.concatenate(accessions), np.concatenate(scores), offsets), read_ids
+
+
+def split_block(block: np.ndarray, columns: int, tab_map: Dict[str, int]) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract the required columns of a block of lines. If every line has the expected number of columns,
+    the columns are gathered by the positions of the separators, else the block is split line by line.
+
+    :param block: bytes of complete lines in tab format, the last line of a file may lack its newline
+    :param columns: expected number of columns per line
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: encoded read id and accession per hit, bit score per hit
+    """
+    # tabs and newlines are the only bytes below 11 in plain text, any other one fails the checks below
+    separators = np.flatnonzero(block < 11)
+    if block[-1] != NEWLINE:
+        separators = np.append(separators, len(block))
+    if len(separators) % columns:
+        return split_lines(block, tab_map)
+    cells = separators.reshape(-1, columns)
+    line_ends = cells[:, -1]
+    if not (np.all(block[cells[:, :-1]] == TAB) and np.all(block[line_ends[:-1]] == NEWLINE)):
+        return split_lines(block, tab_map)
+    # every cell starts after the separator before it
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    cell_starts = np.column_stack((line_starts, cells[:, :-1] + 1))
+
+    def column(index: int, trim: int = 0) -> np.ndarray:
+        return gather(block, cell_starts[:, index], cells[:, index] - trim)
+
+    # version suffix of accessions is dropped
+    return column(tab_map['qseqid']), column(tab_map['sseqid'], 2), column(tab_map['bitscore']).astype(np.float64)
+
+
+def gather(block: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Copy one cell per line into fixed width byte strings
+
+    :param block: bytes of lines
+    :param starts: index of the first byte of every cell
+    :param ends: index after the last byte of every cell
+    :return: cells padded to the longest one
+    """
+    width = max(int(np.max(ends - starts, initial=0)), 1)
+    indices = starts[:, None] + np.arange(width)
+    chars = block.take(indices, mode='clip')
+    chars[indices >= ends[:, None]] = 0
+    return chars.view('S' + str(width)).ravel()
+
+
+def split_lines(block: np.ndarray, tab_map: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split a block of lines in tab format line by line up to the last required column
+
+    :param block: bytes of lines in tab format
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: encoded read id and accession per hit, bit score per hit
+    """
+    qseqid = tab_map['qseqid']
+    sseqid = tab_map['sseqid']
+    bitscore = tab_map['bitscore']
+    # columns after the last required one are not split
+    splits = max(qseqid, sseqid, bitscore) + 1
+    ids = []
+    accessions = []
+    scores = []
+    for line in block.tobytes().split(b'\n'):
+        if not line:
+            continue
+        fields = line.split(b'\t', splits)
+        ids.append(fields[qseqid])
+        accessions.append(fields[sseqid][:-2])
+        scores.append(fields[bitscore])
+    return np.array(ids, dtype=bytes), np.array(accessions, dtype=bytes), np.array(scores, dtype=np.float64)
+
+
+def decode(encoded: np.ndarray) -> List[str]:
+    """
+    :param encoded: array of byte strings
+    :return: list of strings
+    """
+    try:
+        return encoded.astype(str).tolist()
+    except UnicodeDecodeError:
+        # only ascii is decoded in bulk
+        return [item.decode() for item in encoded.tolist()]
+
+
+def parse_filter_mmap(file: str, top_score_percent: float, tab_map: Dict[str, int],
+                      hit_limit: Optional[HitLimit] = None) -> Tuple[ScoreArray, List[str]]:
+    """
+    Memory map a file in tab format, extract reads containing accessions and bit scores
+    and filter accessions in each read by the top score percentage.
+    Equivalent to parse_filter, but considerably faster on plain text.
+    Only accessions that pass the filters are decoded.
+
+    :param file: filepath
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param hit_limit: limits hits per read before the top score filter
+    :return: accessions filtered by top score percentage with scores and offsets per read, list of read ids
+    """
+    score_array, read_ids = parse_score_array_mmap(file, tab_map)
+    if hit_limit:
+        score_array, dropped = limit_score_array(score_array, hit_limit.max_hits, hit_limit.min_bitscore)
+        hit_limit.dropped += dropped
+    filtered = filter_score_array(score_array, top_score_percent)
+    return filtered._replace(accessions=decode(filtered.accessions)), read_ids
@@ -0,0 +1,234 @@
+import os
+from heapq import merge
+from math import ceil
+from pickle import dump, load
+from tempfile import TemporaryDirectory, mkstemp
+from typing import List, Tuple, Dict, Iterator, Iterable, Optional
+
+from pygan.blast.blast_parser import filter_by_top_score
+from pygan.blast.hit_limit import HitLimit
+from pygan.storage.spill import SpillList, SpillIds
+
+# partition files open at once and runs merged at once, well below common limits of open files
+MAX_PARTITIONS = 256
+# partitioning rounds after which a partition is grouped in memory regardless of its size
+MAX_DEPTH = 4
+
+
+def group_hits(file: str, tab_map: Dict[str, int], memory_limit: int, directory: Optional[str] = None) \
+        -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+    """
+    Group hits of a file in tab format by read id, no matter where in the file they are.
+    Reads are yielded in order of their first hit in the file, as by the parsers of continuous files.
+
+    If the file is larger than the memory limit, its lines are hash-partitioned by read id into
+    temporary files first, see partition_lines. Every partition is grouped on its own into a run of reads
+    ordered by their first hit, and the runs are merged by it.
+
+    :param file: filepath
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_limit: approximate number of bytes of the file to be grouped in memory at once
+    :param directory: directory for partition files, system default if None
+    :return: generator of read ids with their accessions and bit scores
+    """
+
+    size = os.path.getsize(file)
+    if size <= memory_limit:
+        with open(file, 'r') as f:
+            yield from group_lines(f, tab_map)
+        return
+
+    with TemporaryDirectory(dir=directory) as tmp:
+        with open(file, 'r') as f:
+            # prefix every line with its index to restore the order of reads
+            runs = partition_lines((str(index) + '\t' + line for index, line in enumerate(f)), size, tab_map,
+                                   memory_limit, tmp)
+        for _, read_id, read in merge_runs(runs, tmp):
+            yield read_id, read
+
+
+def partition_lines(lines: Iterable[str], size: int, tab_map: Dict[str, int], memory_limit: int, tmp: str,
+                    depth: int = 0) -> List[str]:
+    """
+    Hash-partition indexed lines by read id into at most MAX_PARTITIONS temporary files and group every partition.
+    Partitions that still exceed the memory limit, e.g. due to skewed read ids, are partitioned again
+    with another hash, up to MAX_DEPTH times. Hits of a read always end up in the same partition.
+
+    :param lines: lines in tab format prefixed with their index in the file
+    :param size: approximate number of bytes of the lines
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_limit: approximate number of bytes to be grouped in memory at once
+    :param tmp: directory for partition and run files
+    :param depth: number of times the lines were partitioned before
+    :return: paths of runs of grouped reads, see write_run
+    """
+    partitions = min(MAX_PARTITIONS, max(2, ceil(size / memory_limit)))
+    # the column of the read id follows the index
+    qseqid = tab_map['qseqid'] + 1
+    paths = []
+    parts = []
+    try:
+        for _ in range(partitions):
+            fd, path = mkstemp(suffix='.part', dir=tmp)
+            paths.append(path)
+            parts.append(os.fdopen(fd, 'w'))
+        sizes = [0] * partitions
+        for line in lines:
+            read_id = line.split('\t', qseqid + 1)[qseqid]
+            i = hash((depth, read_id)) % partitions
+            parts[i].write(line)
+            sizes[i] += len(line)
+    finally:
+        for part in parts:
+            part.close()
+
+    runs = []
+    for path, part_size in zip(paths, sizes):
+        # partition again unless hits of a single read dominate
+        if part_size > memory_limit and depth + 1 < MAX_DEPTH and part_size < size:
+            with open(path, 'r') as f:
+                runs += partition_lines(f, part_size, tab_map, memory_limit, tmp, depth + 1)
+        elif part_size:
+            runs.append(write_run(path, tab_map, tmp))
+        os.remove(path)
+    return runs
+
+
+def write_run(path: str, tab_map: Dict[str, int], tmp: str) -> str:
+    """
+    Group the indexed lines of a partition in memory and write its reads in order of their first hit
+
+    :param path: partition file
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param tmp: directory for the run file
+    :return: path of the run, a sequence of pickled (index of first hit, read id, hits) tuples
+    """
+    qseqid = tab_map['qseqid'] + 1
+    sseqid = tab_map['sseqid'] + 1
+    bitscore = tab_map['bitscore'] + 1
+
+    reads = {}
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip('\n').split('\t')
+            read_id = line[qseqid]
+            hit = (line[sseqid][:-2], float(line[bitscore]))
+            if read_id in reads:
+                reads[read_id][1].append(hit)
+            else:
+                reads[read_id] = (int(line[0]), [hit])
+
+    fd, run = mkstemp(suffix='.run', dir=tmp)
+    with os.fdopen(fd, 'wb') as f:
+        # lines of a partition keep their order, so reads are ordered by their first hit
+        for read_id, (index, hits) in reads.items():
+            dump((index, read_id, hits), f)
+    return run
+
+
+def merge_runs(runs: List[str], tmp: str) -> Iterator[Tuple[int, str, List[Tuple[str, float]]]]:
+    """
+    Merge runs of grouped reads by the index of their first hit.
+    More than MAX_PARTITIONS runs are merged in several passes.
+
+    :param runs: paths of runs, removed once merged
+    :param tmp: directory for intermediate runs
+    :return: generator of reads with the index of their first hit
+    """
+    while len(runs) > MAX_PARTITIONS:
+        merged = []
+        for i in range(0, len(runs), MAX_PARTITIONS):
+            fd, run = mkstemp(suffix='.run', dir=tmp)
+            with os.fdopen(fd, 'wb') as f:
+                for entry in merge(*map(read_run, runs[i:i + MAX_PARTITIONS])):
+                    dump(entry, f)
+            merged.append(run)
+        runs = merged
+    yield from merge(*map(read_run, runs))
+
+
+def read_run(path: str) -> Iterator[Tuple[int, str, List[Tuple[str, float]]]]:
+    """
+    :param path: path of a run, removed once read
+    :return: generator of the reads of the run
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield load(f)
+            except EOFError:
+                break
+    os.remove(path)
+
+
+def group_lines(lines: Iterable[str], tab_map: Dict[str, int]) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+    """
+    Group lines in tab format by read id in memory
+
+    :param lines: lines in tab format
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: generator of read ids with their accessions and bit scores in order of their first hit
+    """
+
+    qseqid = tab_map['qseqid']
+    sseqid = tab_map['sseqid']
+    bitscore = tab_map['bitscore']
+
+    reads = {}
+    for line in lines:
+        line = line.strip('\n').split('\t')
+        read_id = line[qseqid]
+        hit = (line[sseqid][:-2], float(line[bitscore]))
+        if read_id in reads:
+            reads[read_id].append(hit)
+        else:
+            reads[read_id] = [hit]
+    yield from reads.items()
+
+
+def parse_filter_unsorted(file: str, top_score_percent: float, tab_map: Dict[str, int], memory_limit: int,
+                          memory_budget: int = 0, directory: Optional[str] = None,
+                          hit_limit: Optional[HitLimit] = None) -> Tuple[List[List[str]], List[str]]:
+    """
+    Read lines of file in tab format whose reads are not necessarily continuous, extract reads containing accessions
+    and bit scores. Filter accessions in each read by the top score percentage.
+
+    :param file: filepath
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_limit: approximate number of bytes of the file to be grouped in memory at once
+    :param memory_budget: maximum number of accessions and read ids held in memory before spilling to disk, 0 to disable
+    :param directory: directory for partition files, system default if None
+    :param hit_limit: limits hits per read before the top score filter
+    :return: list of accessions per read filtered by top score percentage, list of read ids
+    """
+
+    reads = SpillList(memory_budget, directory) if memory_budget else []
+    read_ids = SpillIds(memory_budget, directory) if memory_budget else []
+    for read_id, read in group_hits(file, tab_map, memory_limit, directory):
+        reads.append(filter_by_top_score(hit_limit.apply(read) if hit_limit else read, top_score_percent))
+        read_ids.append(read_id)
+    return reads, read_ids
+
+
+def parse_with_score_unsorted(file: str, tab_map: Dict[str, int], memory_limit: int,
+                              directory: Optional[str] = None, hit_limit: Optional[HitLimit] = None) \
+        -> Tuple[List[List[Tuple[str, float]]], List[str]]:
+    """
+    Read lines of file in tab format whose reads are not necessarily continuous,
+    extract reads containing accessions and bit scores.
+
+    :param file: filepath
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_limit: approximate number of bytes of the file to be grouped in memory at once
+    :param directory: directory for partition files, system default if None
+    :param hit_limit: limits hits per read
+    :return: list of accessions with bit scores per read, list of read ids
+    """
+
+    reads = []
+    read_ids = []
+    for read_id, read in group_hits(file, tab_map, memory_limit, directory):
+        reads.append(hit_limit.apply(read) if hit_limit else read)
+        read_ids.append(read_id)
+    return reads, read_ids
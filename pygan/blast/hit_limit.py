@@ -0,0 +1,36 @@
+from heapq import nlargest
+from typing import List, Tuple
+
+
+class HitLimit:
+    """
+    Limits the hits of every read while parsing, before they are filtered by top score and looked up
+
+    Hits scoring below min_bitscore are dropped, then only the max_hits best scoring hits of a read are kept
+    in their original order, earlier hits win ties. Counts the dropped hits over all reads.
+    Reads without remaining hits are kept and assigned like reads without known accessions.
+    """
+
+    def __init__(self, max_hits: int = 0, min_bitscore: float = 0):
+        """
+        :param max_hits: maximum number of hits kept per read, 0 to keep all
+        :param min_bitscore: minimum bit score of a hit, 0 to keep all
+        """
+        self.max_hits = max_hits
+        self.min_bitscore = min_bitscore
+        self.dropped = 0
+
+    def apply(self, read: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+        """
+        :param read: accessions with bit scores of a read
+        :return: remaining accessions with bit scores of the read
+        """
+        hits = len(read)
+        if self.min_bitscore:
+            read = [hit for hit in read if not hit[1] < self.min_bitscore]
+        if 0 < self.max_hits < len(read):
+            # select positions of the best hits with a heap and restore their order
+            best = sorted(nlargest(self.max_hits, range(len(read)), key=lambda i: read[i][1]))
+            read = [read[i] for i in best]
+        self.dropped += hits - len(read)
+        return read
@@ -0,0 +1,109 @@
+from math import exp, floor, log
+from random import Random
+from typing import List, Tuple, Dict, Optional
+
+from pygan.blast.blast_parser import filter_by_top_score
+
+
+def parse_filter_sample(file: str, top_score_percent: float, tab_map: Dict[str, int], sample_fraction: float = 0,
+                        sample_size: int = 0, seed: Optional[int] = None) -> Tuple[List[List[str]], List[str], int]:
+    """
+    Read lines of file in tab format and extract a uniform random sample of reads containing accessions
+    and bit scores. Filter accessions in each sampled read by the top score percentage.
+    Only lines of sampled reads are split into columns, other reads are only counted.
+    Assumes that reads are continuous.
+
+    With sample_size, a reservoir of that many reads is kept while streaming (Algorithm L),
+    else every read is sampled with probability sample_fraction. Sampled reads keep their order in the file.
+
+    :param file: filepath
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param sample_fraction: probability in (0, 1] of a read to be sampled
+    :param sample_size: number of reads to sample, takes precedence over sample_fraction
+    :param seed: seed of the random generator, random if None
+    :return: list of accessions per sampled read filtered by top score percentage, list of sampled read ids,
+        number of reads in the file
+    """
+    if sample_size < 1 and not 0 < sample_fraction <= 1:
+        raise ValueError('Either sample_size or sample_fraction in (0, 1] is required')
+
+    qseqid = tab_map['qseqid']
+    sseqid = tab_map['sseqid']
+    bitscore = tab_map['bitscore']
+    rng = Random(seed)
+
+    # sampled reads as (index in file, accessions, read id), a reservoir slot is replaced by a later read
+    sample: List[Tuple[int, List[str], str]] = []
+    weight = exp(log(rng.random()) / sample_size) if sample_size > 0 else 0
+    next_index = next_sample(-1, sample_fraction, sample_size, weight, rng)
+    index = -1
+    read = None
+    read_id = None
+
+    with open(file, 'r') as f:
+        for line in f:
+            next_id = line.split('\t', qseqid + 1)[qseqid]
+            # new read
+            if next_id != read_id:
+                # flush last read
+                if read is not None:
+                    weight = store_sample(sample, index, filter_by_top_score(read, top_score_percent), read_id,
+                                          sample_size, weight, rng)
+                    next_index = next_sample(index, sample_fraction, sample_size, weight, rng)
+                index += 1
+                read_id = next_id
+                read = [] if index == next_index else None
+            # expand sampled read
+            if read is not None:
+                line = line.strip('\n').split('\t')
+                read.append((line[sseqid][:-2], float(line[bitscore])))
+        # flush last read
+        if read is not None:
+            store_sample(sample, index, filter_by_top_score(read, top_score_percent), read_id, sample_size, weight, rng)
+
+    sample.sort(key=lambda entry: entry[0])
+    return [accessions for _, accessions, _ in sample], [read_id for _, _, read_id in sample], index + 1
+
+
+def next_sample(index: int, sample_fraction: float, sample_size: int, weight: float, rng: Random) -> int:
+    """
+    Skip reads that are not sampled at once by drawing the gap to the next sampled read
+
+    :param index: index of the last read
+    :param sample_fraction: probability of a read to be sampled
+    :param sample_size: number of reads to sample, 0 to sample by fraction
+    :param weight: current weight of the reservoir
+    :param rng: random generator
+    :return: index of the next sampled read
+    """
+    if sample_size > 0:
+        # fill the reservoir first
+        if index + 1 < sample_size:
+            return index + 1
+        return index + 1 + floor(log(1 - rng.random()) / log(1 - weight))
+    if sample_fraction >= 1:
+        return index + 1
+    return index + 1 + floor(log(1 - rng.random()) / log(1 - sample_fraction))
+
+
+def store_sample(sample: List[Tuple[int, List[str], str]], index: int, accessions: List[str], read_id: str,
+                 sample_size: int, weight: float, rng: Random) -> float:
+    """
+    Add a sampled read, replacing a random read of a full reservoir
+
+    :param sample: sampled reads
+    :param index: index of the read in the file
+    :param accessions: accessions of the read
+    :param read_id: read id
+    :param sample_size: number of reads to sample, 0 to sample by fraction
+    :param weight: current weight of the reservoir
+    :param rng: random generator
+    :return: weight of the reservoir for the next gap
+    """
+    entry = (index, accessions, read_id)
+    if sample_size < 1 or len(sample) < sample_size:
+        sample.append(entry)
+        return weight
+    sample[rng.randrange(sample_size)] = entry
+    return weight * exp(log(rng.random()) / sample_size)
@@ -0,0 +1,165 @@
+from typing import List, Tuple, Dict, NamedTuple, Union
+
+import numpy as np
+
+
+class ScoreArray(NamedTuple):
+    """
+    Flat representation of reads with scores
+
+    Hits of read i are accessions[offsets[i]:offsets[i + 1]] with scores[offsets[i]:offsets[i + 1]].
+    Accessions may be held as an array of encoded accessions until they are needed as strings.
+    """
+    accessions: Union[List[str], np.ndarray]
+    scores: np.ndarray
+    offsets: np.ndarray
+
+
+def parse_score_array(file: str, tab_map: Dict[str, int]) -> Tuple[ScoreArray, List[str]]:
+    """
+    Read lines of file in tab format, extract reads containing accessions and bit scores
+    into one flat list of accessions, one float array of scores and per-read offsets.
+    Assumes that reads are continuous.
+
+    :param file: filepath
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: accessions with scores and offsets per read, list of read ids
+    """
+
+    qseqid = tab_map['qseqid']
+    sseqid = tab_map['sseqid']
+    bitscore = tab_map['bitscore']
+
+    accessions = []
+    scores = []
+    offsets = []
+    read_ids = []
+    read_id = None
+
+    with open(file, 'r') as f:
+        for line in f:
+            line = line.strip('\n').split('\t')
+            next_id = line[qseqid]
+            # first or new read
+            if next_id != read_id:
+                offsets.append(len(accessions))
+                read_ids.append(next_id)
+                read_id = next_id
+            accessions.append(line[sseqid][:-2])
+            scores.append(line[bitscore])
+    offsets.append(len(accessions))
+
+    # convert scores in bulk
+    return ScoreArray(accessions, np.array(scores, dtype=np.float64), np.array(offsets, dtype=np.int64)), read_ids
+
+
+def to_score_array(reads_ws: List[List[Tuple[str, float]]]) -> ScoreArray:
+    """
+    Convert reads with scores to their flat representation
+
+    :param reads_ws: list of accessions with scores per read
+    :return: accessions with scores and offsets per read
+    """
+    accessions = [accession for read in reads_ws for accession, _ in read]
+    scores = np.fromiter((score for read in reads_ws for _, score in read), dtype=np.float64, count=len(accessions))
+    offsets = np.zeros(len(reads_ws) + 1, dtype=np.int64)
+    np.cumsum([len(read) for read in reads_ws], out=offsets[1:])
+    return ScoreArray(accessions, scores, offsets)
+
+
+def limit_score_array(score_array: ScoreArray, max_hits: int = 0, min_bitscore: float = 0) \
+        -> Tuple[ScoreArray, int]:
+    """
+    Drop hits scoring below a minimum bit score, then keep only the best scoring hits of every read
+    in their original order, earlier hits win ties. Equivalent to HitLimit applied to every read.
+
+    :param score_array: accessions with scores and offsets per read
+    :param max_hits: maximum number of hits kept per read, 0 to keep all
+    :param min_bitscore: minimum bit score of a hit, 0 to keep all
+    :return: remaining accessions with scores and offsets per read, number of dropped hits
+    """
+    _, scores, offsets = score_array
+    keep = scores >= min_bitscore if min_bitscore else np.ones(len(scores), dtype=bool)
+    if max_hits > 0:
+        positions = np.arange(len(scores))
+        read_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        # hits of a read by descending score with dropped hits last
+        order = np.lexsort((positions, -scores, ~keep, read_index))
+        rank = np.empty(len(scores), dtype=np.int64)
+        rank[order] = positions - offsets[read_index[order]]
+        keep &= rank < max_hits
+    kept = np.flatnonzero(keep)
+    return take_hits(score_array, kept), len(scores) - len(kept)
+
+
+def top_score_mask(score_array: ScoreArray, top_score_percent: float) -> np.ndarray:
+    """
+    Determine which hits are within the percentage of the top score of their read.
+    Equivalent to filter_by_top_score applied to every read.
+
+    :param score_array: accessions with scores and offsets per read
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :return: boolean mask over all hits
+    """
+    scores = score_array.scores
+    offsets = score_array.offsets
+    lengths = np.diff(offsets)
+    top_scores = np.zeros(len(lengths), dtype=np.float64)
+    # reduceat can not handle empty segments, these keep a top score of 0
+    non_empty = lengths > 0
+    if scores.size:
+        top_scores[non_empty] = np.maximum.reduceat(scores, offsets[:-1][non_empty])
+    np.maximum(top_scores, 0, out=top_scores)
+    bounds = top_scores - top_scores * top_score_percent
+    return scores >= np.repeat(bounds, lengths)
+
+
+def filter_score_array(score_array: ScoreArray, top_score_percent: float) -> ScoreArray:
+    """
+    Filter accessions in every read by the top score percentage.
+
+    Example: top score = 50, top_score_percent = 0.1: 47 remains, 43 is discarded.
+
+    :param score_array: accessions with scores and offsets per read
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :return: accessions with scores >= top_score_percent of top score and offsets per read
+    """
+    return take_hits(score_array, np.flatnonzero(top_score_mask(score_array, top_score_percent)))
+
+
+def take_hits(score_array: ScoreArray, kept: np.ndarray) -> ScoreArray:
+    """
+    :param score_array: accessions with scores and offsets per read
+    :param kept: ascending indices of the hits to keep
+    :return: kept accessions with scores and offsets per read
+    """
+    accessions = score_array.accessions
+    if isinstance(accessions, np.ndarray):
+        accessions = accessions[kept]
+    else:
+        accessions = [accessions[i] for i in kept.tolist()]
+    # offsets of the reads in the kept hits
+    return ScoreArray(accessions, score_array.scores[kept], np.searchsorted(kept, score_array.offsets).astype(np.int64))
+
+
+def slice_score_array(score_array: ScoreArray, start: int, end: int) -> ScoreArray:
+    """
+    :param score_array: accessions with scores and offsets per read
+    :param start: index of the first read
+    :param end: index after the last read
+    :return: reads start to end with offsets starting at 0, scores are a view
+    """
+    accessions, scores, offsets = score_array
+    first = int(offsets[start])
+    last = int(offsets[end])
+    return ScoreArray(accessions[first:last], scores[first:last], offsets[start:end + 1] - first)
+
+
+def to_reads(score_array: ScoreArray) -> List[List[str]]:
+    """
+    :param score_array: accessions with scores and offsets per read
+    :return: list of accessions per read
+    """
+    accessions = score_array.accessions
+    offsets = score_array.offsets.tolist()
+    return [accessions[offsets[i - 1]:offsets[i]] for i in range(1, len(offsets))]
@@ -0,0 +1,133 @@
+import os
+from typing import List, Tuple, Dict, BinaryIO, Iterable, Iterator
+
+from pygan.blast.blast_parser import filter_by_top_score
+
+
+def compute_shards(file: str, shards: int, tab_map: Dict[str, int]) -> List[Tuple[int, int]]:
+    """
+    Split a file in tab format into byte ranges of roughly equal size.
+    Every range starts at the first hit of a read, so no read is split across ranges.
+    Assumes that reads are continuous.
+
+    :param file: filepath
+    :param shards: desired number of ranges, fewer are returned for small files
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(file)
+    qseqid = tab_map['qseqid']
+    boundaries = [0]
+    with open(file, 'rb') as f:
+        for i in range(1, shards):
+            boundary = find_read_boundary(f, max(size * i // shards, boundaries[-1]), qseqid)
+            if boundary >= size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(size)
+    return [(boundaries[i - 1], boundaries[i]) for i in range(1, len(boundaries))]
+
+
+def find_read_boundary(f: BinaryIO, offset: int, qseqid: int) -> int:
+    """
+    Find the offset of the first line at or after an offset whose read id differs from the preceding line
+
+    :param f: file opened in binary mode
+    :param offset: byte offset to start searching at
+    :param qseqid: column of the read id
+    :return: byte offset of the first hit of the next read, or the file size
+    """
+    if offset == 0:
+        return 0
+    # skip to the start of the next complete line
+    f.seek(offset - 1)
+    f.readline()
+    position = f.tell()
+    line = f.readline()
+    if not line:
+        return position
+    read_id = line.split(b'\t')[qseqid]
+    position = f.tell()
+    line = f.readline()
+    while line and line.split(b'\t')[qseqid] == read_id:
+        position = f.tell()
+        line = f.readline()
+    return position
+
+
+def parse_filter_range(file: str, top_score_percent: float, tab_map: Dict[str, int], start: int, end: int) \
+        -> Tuple[List[List[str]], List[str]]:
+    """
+    Read lines of a byte range of a file in tab format, extract reads containing accessions and bit scores.
+    Filter accessions in each read by the top score percentage.
+    The range is expected to start and end at read boundaries, see compute_shards.
+
+    :param file: filepath
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param start: byte offset of the first line
+    :param end: byte offset after the last line
+    :return: list of accessions per read filtered by top score percentage, list of read ids
+    """
+    with open(file, 'rb') as f:
+        f.seek(start)
+        return parse_filter_lines(read_range(f, start, end), top_score_percent, tab_map)
+
+
+def read_range(f: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """
+    :param f: file opened in binary mode and positioned at start
+    :param start: byte offset of the first line
+    :param end: byte offset after the last line
+    :return: generator of the lines of the range
+    """
+    position = start
+    while position < end:
+        raw = f.readline()
+        if not raw:
+            break
+        position += len(raw)
+        yield raw
+
+
+def parse_filter_lines(lines: Iterable[bytes], top_score_percent: float, tab_map: Dict[str, int]) \
+        -> Tuple[List[List[str]], List[str]]:
+    """
+    Extract reads containing accessions and bit scores from lines in tab format.
+    Filter accessions in each read by the top score percentage.
+
+    :param lines: complete lines of whole reads
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: list of accessions per read filtered by top score percentage, list of read ids
+    """
+
+    qseqid = tab_map['qseqid']
+    sseqid = tab_map['sseqid']
+    bitscore = tab_map['bitscore']
+
+    reads = []
+    read_ids = []
+    read = None
+    read_id = None
+
+    for raw in lines:
+        line = raw.decode().strip('\n').split('\t')
+        next_id = line[qseqid]
+        # new read
+        if next_id != read_id:
+            # flush last read
+            if read is not None:
+                reads.append(filter_by_top_score(read, top_score_percent))
+                read_ids.append(read_id)
+            read = []
+            read_id = next_id
+        # expand read
+        read.append((line[sseqid][:-2], float(line[bitscore])))
+    # flush last read
+    if read is not None:
+        reads.append(filter_by_top_score(read, top_score_percent))
+        read_ids.append(read_id)
+
+    return reads, read_ids
@@ -0,0 +1,185 @@
+import json
+import os
+import socket
+import socketserver
+from argparse import ArgumentParser
+from threading import Thread
+from time import time
+from typing import Dict, Any
+
+from pygan.algorithms.lca import LcaCache
+from pygan.database.megan_map import connect, disconnect
+from pygan.lca_analysis import parse_tree, compute_lca_addresses, classify_sample, write_results, format_results, \
+    write_read_index, load_megan_map_filter, timer
+
+# parameters of a job that may be omitted by the client
+DEFAULT_JOB = {
+    'blast_map': {'qseqid': 0, 'sseqid': 1, 'bitscore': 2},
+    'top_score_percent': 0.1,
+    'db_segment_size': 10000,
+    'ignore_ancestors': False,
+    'min_support': 0,
+    'only_major': False,
+    'exclude': [],
+    'project_mode': '',
+    'project_rank': '',
+    'cluster_degree': 0,
+    'out_file': '',
+    'prefix_rank': True,
+    'show_path': False,
+    'list_reads': False,
+    'memory_budget': 0,
+    'compact_reads': False,
+    'unsorted_memory': 0,
+    'db_threads': 0,
+    'fast_parser': False,
+    'assignments_file': '',
+    'max_hits': 0,
+    'min_bitscore': 0,
+    'read_index_file': ''
+}
+
+
+class LcaDaemon(socketserver.UnixStreamServer):
+    """
+    Long-running LCA analysis server listening on a Unix socket
+
+    Keeps the phylogenetic tree, its LCA addresses, a connection to megan_map.db and, if requested,
+    its accession filter in memory, so every job only pays for its per-sample stages. Jobs are handled one at a time.
+    Memoized LCAs are kept across jobs.
+    """
+
+    def __init__(self, socket_path: str, tre_file: str, map_file: str, megan_map_file: str, db_key: str,
+                 lca_cache_size: int = 0, use_accession_filter: bool = False):
+        self.megan_map_file = megan_map_file
+        self.db_key = db_key
+        self.tree = parse_tree(tre_file, map_file)
+        self.id2address, self.address2id = compute_lca_addresses(self.tree)
+        self.lca_cache = LcaCache(self.id2address, self.address2id, lca_cache_size) if lca_cache_size else None
+        self.connection = connect(megan_map_file)
+        self.accession_filter = load_megan_map_filter(megan_map_file) if use_accession_filter else None
+        # remove stale socket of a previous server
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _JobHandler)
+
+    def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Classify a single sample with the prepared state
+
+        :param job: blast_file and optional parameters of classify_sample and write_results
+        :return: response with out_file or the result lines if no out_file was requested
+        """
+        t = time()
+        params = {**DEFAULT_JOB, **job}
+        assignments = open(params['assignments_file'], 'w') if params['assignments_file'] else None
+        try:
+            classify_sample(self.tree, self.id2address, self.address2id, self.megan_map_file, params['blast_file'],
+                            params['blast_map'], params['top_score_percent'], params['db_segment_size'], self.db_key,
+                            params['ignore_ancestors'], params['min_support'], params['only_major'],
+                            params['exclude'], params['project_mode'], params['project_rank'],
+                            params['cluster_degree'], self.connection, params['memory_budget'],
+                            params['compact_reads'], params['unsorted_memory'], self.accession_filter,
+                            params['db_threads'], params['fast_parser'], assignments, params['max_hits'],
+                            params['min_bitscore'], self.lca_cache,
+                            params['list_reads'] or bool(params['read_index_file']))
+        finally:
+            if assignments:
+                assignments.close()
+        response = {'status': 'ok'}
+        if params['assignments_file']:
+            response['assignments_file'] = params['assignments_file']
+        if params['read_index_file']:
+            write_read_index(self.tree, params['read_index_file'])
+            response['read_index_file'] = params['read_index_file']
+        if params['out_file']:
+            write_results(self.tree, params['out_file'], params['prefix_rank'], params['show_path'],
+                          params['list_reads'])
+            response['out_file'] = params['out_file']
+        else:
+            response['result'] = format_results(self.tree, params['prefix_rank'], params['show_path'],
+                                                params['list_reads'])
+        self.tree.clear_reads()
+        response['seconds'] = float(timer(t))
+        return response
+
+    def server_close(self):
+        super().server_close()
+        disconnect(self.connection)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON job per line and answers with one JSON response per line
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if job.get('command') == 'shutdown':
+                    self._respond({'status': 'ok'})
+                    # shutdown blocks until serve_forever returns, which waits for this handler
+                    Thread(target=self.server.shutdown).start()
+                    return
+                response = self.server.run_job(job)
+            except Exception as e:
+                response = {'status': 'error', 'error': type(e).__name__ + ': ' + str(e)}
+            self._respond(response)
+
+    def _respond(self, response: Dict[str, Any]):
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+        self.wfile.flush()
+
+
+def serve(socket_path: str, tre_file: str, map_file: str, megan_map_file: str, db_key: str,
+          lca_cache_size: int = 0, use_accession_filter: bool = False):
+    """
+    Prepare the tree and serve LCA analysis jobs on a Unix socket until shut down
+
+    :param socket_path: path of the Unix socket to listen on
+    :param tre_file: path to file containing phylogenetic tree
+    :param map_file: path to file containing mapping of taxonomy id to scientific name and rank
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param lca_cache_size: maximum number of distinct sets of taxons per read whose LCA is memoized, 0 to disable
+    :param use_accession_filter: skip accessions missing from megan_map.db according to the filter stored next to it
+    """
+    with LcaDaemon(socket_path, tre_file, map_file, megan_map_file, db_key, lca_cache_size,
+                   use_accession_filter) as server:
+        print('serving lca analysis on ' + socket_path)
+        server.serve_forever()
+
+
+def submit(socket_path: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Submit a job to a running LCA analysis server and wait for its response
+
+    :param socket_path: path of the Unix socket the server listens on
+    :param job: blast_file and optional parameters, or {'command': 'shutdown'}
+    :return: response of the server
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        with s.makefile('rwb') as f:
+            f.write(json.dumps(job).encode() + b'\n')
+            f.flush()
+            return json.loads(f.readline())
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Serve LCA analysis jobs on a Unix socket')
+    parser.add_argument('socket_path')
+    parser.add_argument('tre_file')
+    parser.add_argument('map_file')
+    parser.add_argument('megan_map_file')
+    parser.add_argument('--db-key', default='Taxonomy')
+    parser.add_argument('--lca-cache-size', type=int, default=0)
+    parser.add_argument('--accession-filter', action='store_true')
+    args = parser.parse_args()
+    serve(args.socket_path, args.tre_file, args.map_file, args.megan_map_file, args.db_key, args.lca_cache_size,
+          args.accession_filter)
@@ -0,0 +1,169 @@
+from threading import Lock
+from typing import Iterable, Iterator, List, Any, Callable, Optional, Sequence, Tuple
+
+# bounds of distinct accessions per batch
+MIN_ACCESSIONS = 1000
+MAX_ACCESSIONS = 200000
+# accessions per batch before the first lookup was measured
+INITIAL_ACCESSIONS = 10000
+# seconds a single lookup should take, long enough to amortize the overhead per query
+TARGET_SECONDS = 0.25
+# upper bound of the size of a query string in bytes
+MAX_QUERY_BYTES = 1 << 23
+# upper bounds of the reads and of the bytes of their accessions buffered per batch, duplicates included
+MAX_READS = 200000
+MAX_BUFFERED_BYTES = 1 << 26
+
+
+class BatchBuffer:
+    """
+    Distinct accessions and sizes of the reads of a batch that is being filled
+    """
+
+    def __init__(self):
+        self.distinct = set()
+        self.query_bytes = 0
+        self.buffered_bytes = 0
+        self.reads = 0
+
+    def add(self, accessions: Iterable[str]):
+        """
+        :param accessions: accessions of the next read
+        """
+        distinct = self.distinct
+        buffered_bytes = 0
+        query_bytes = 0
+        for acc in accessions:
+            buffered_bytes += len(acc)
+            if acc not in distinct:
+                distinct.add(acc)
+                # quotes and separator of every accession in the query
+                query_bytes += len(acc) + 3
+        self.buffered_bytes += buffered_bytes
+        self.query_bytes += query_bytes
+        self.reads += 1
+
+
+class AdaptiveBatcher:
+    """
+    Groups consecutive reads into batches for database lookups by their number of distinct accessions
+    instead of a fixed number of reads.
+
+    The size of following batches is tuned from the measured throughput of every lookup, so a lookup takes about
+    target_seconds, within the bounds of min_accessions and max_accessions. Batches are also cut before their
+    query string exceeds max_query_bytes, and before they buffer more than max_reads reads or max_buffered_bytes
+    bytes of accessions, which bounds their memory if accessions repeat a lot. A batch cut by memory caps the size
+    to its distinct accessions, so slow lookups do not grow it past what fits.
+    Lookups may be recorded from several threads.
+    """
+
+    def __init__(self, min_accessions: int = MIN_ACCESSIONS, max_accessions: int = MAX_ACCESSIONS,
+                 initial_accessions: int = INITIAL_ACCESSIONS, target_seconds: float = TARGET_SECONDS,
+                 max_query_bytes: int = MAX_QUERY_BYTES, max_reads: int = MAX_READS,
+                 max_buffered_bytes: int = MAX_BUFFERED_BYTES):
+        """
+        :param min_accessions: lower bound of distinct accessions per batch
+        :param max_accessions: upper bound of distinct accessions per batch
+        :param initial_accessions: distinct accessions of the first batches
+        :param target_seconds: seconds a single lookup should take
+        :param max_query_bytes: upper bound of the size of a query string in bytes
+        :param max_reads: upper bound of reads per batch
+        :param max_buffered_bytes: upper bound of the bytes of all accessions of the reads of a batch
+        """
+        if not 0 < min_accessions <= max_accessions:
+            raise ValueError('Bounds of accessions per batch must satisfy 0 < min_accessions <= max_accessions')
+        self.min_accessions = min_accessions
+        self.max_accessions = max_accessions
+        self.target_seconds = target_seconds
+        self.max_query_bytes = max_query_bytes
+        self.max_reads = max_reads
+        self.max_buffered_bytes = max_buffered_bytes
+        self.size = min(max(initial_accessions, min_accessions), max_accessions)
+        # smoothed accessions looked up per second
+        self.throughput: Optional[float] = None
+        self.batches = 0
+        self._lock = Lock()
+
+    def segments(self, reads: Iterable[Any], read_accessions: Optional[Callable[[Any], Iterable[str]]] = None) \
+            -> Iterator[List[Any]]:
+        """
+        Group consecutive reads into batches of about the current size without requiring random access to the reads
+
+        :param reads: reads as list or spilled to disk
+        :param read_accessions: collects the accessions of a read, the read itself if None
+        :return: generator of batches of reads
+        """
+        segment = []
+        buffer = BatchBuffer()
+        for read in reads:
+            buffer.add(read_accessions(read) if read_accessions else read)
+            segment.append(read)
+            if self.cut(buffer):
+                yield segment
+                segment = []
+                buffer = BatchBuffer()
+        if segment:
+            self.batches += 1
+            yield segment
+
+    def spans(self, accessions: List[str], offsets: Sequence[int]) -> Iterator[Tuple[int, int]]:
+        """
+        Group consecutive reads in flat form into batches of about the current size
+
+        :param accessions: accessions of all reads
+        :param offsets: len(reads) + 1 read boundaries in accessions
+        :return: generator of ranges of reads as index of the first read and index after the last read
+        """
+        start = 0
+        buffer = BatchBuffer()
+        for i in range(1, len(offsets)):
+            buffer.add(accessions[offsets[i - 1]:offsets[i]])
+            if self.cut(buffer):
+                yield start, i
+                start = i
+                buffer = BatchBuffer()
+        if start < len(offsets) - 1:
+            self.batches += 1
+            yield start, len(offsets) - 1
+
+    def cut(self, buffer: BatchBuffer) -> bool:
+        """
+        Decide whether a batch ends after the last buffered read and count it if so
+
+        :param buffer: reads buffered for the current batch
+        :return: whether the batch is complete
+        """
+        full = buffer.reads >= self.max_reads or buffer.buffered_bytes >= self.max_buffered_bytes
+        if full or len(buffer.distinct) >= self.size or buffer.query_bytes >= self.max_query_bytes:
+            if full:
+                self.clamp(len(buffer.distinct))
+            self.batches += 1
+            return True
+        return False
+
+    def record(self, accessions: int, seconds: float):
+        """
+        Tune the size of following batches from a measured lookup.
+        The size changes by a factor of at most two per lookup.
+
+        :param accessions: number of distinct accessions looked up
+        :param seconds: duration of the lookup
+        """
+        if accessions == 0 or seconds <= 0:
+            return
+        with self._lock:
+            throughput = accessions / seconds
+            self.throughput = throughput if self.throughput is None else (self.throughput + throughput) / 2
+            size = min(max(self.throughput * self.target_seconds, self.size / 2), self.size * 2)
+            self.size = int(min(max(size, self.min_accessions), self.max_accessions))
+
+    def clamp(self, accessions: int):
+        """
+        Cap the size to the distinct accessions of a batch that was cut by its memory bound,
+        a larger size could not be reached by the following batches either
+
+        :param accessions: number of distinct accessions of the batch
+        """
+        with self._lock:
+            self.size = min(self.size, max(accessions, self.min_accessions))
+
@@ -0,0 +1,213 @@
+import os
+import struct
+from argparse import ArgumentParser
+from math import ceil, log
+from typing import Optional, Tuple, List
+
+import numpy as np
+
+from pygan.database.megan_map import connect, disconnect
+
+# file signature and header of size in bits, number of hashes and size and modification time of the source
+MAGIC = b'PYGANBF3'
+HEADER = struct.Struct('<QIQq')
+# parameters of 64-bit FNV-1a
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+# accessions read from the database and added at once
+BUILD_CHUNK = 1 << 16
+
+
+class BloomFilter:
+    """
+    Probabilistic set of accessions without false negatives
+
+    An accession that is not contained is definitely missing from the set it was built from,
+    an accession that is contained is present with a probability of 1 - error rate.
+    Accessions are hashed and probed in bulk, a single accession is probed like a list of one.
+    """
+
+    def __init__(self, size: int, hashes: int, bits: Optional[bytearray] = None, source: Tuple[int, int] = (0, 0)):
+        """
+        :param size: number of bits
+        :param hashes: number of hash functions
+        :param bits: bit array of an existing filter
+        :param source: size and modification time in nanoseconds of the file the filter was built from
+        """
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray(ceil(size / 8))
+        self.source = source
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> 'BloomFilter':
+        """
+        Create an empty filter sized for a number of items and a false positive rate
+
+        :param capacity: expected number of items
+        :param error_rate: false positive rate in (0, 1)
+        :return: empty filter
+        """
+        capacity = max(1, capacity)
+        size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        hashes = max(1, round(size / capacity * log(2)))
+        return cls(size, hashes)
+
+    def _positions(self, items: List[str]) -> np.ndarray:
+        """
+        Compute bit positions of items by double hashing
+
+        :param items: accessions
+        :return: array of one row of bit positions per item
+        """
+        h1 = hash_items(items)
+        h2 = mix(h1 ^ FNV_PRIME) | np.uint64(1)
+        # arithmetic wraps around at 64 bits
+        return (h1[:, None] + np.arange(self.hashes, dtype=np.uint64) * h2[:, None]) % np.uint64(self.size)
+
+    def add(self, item: str):
+        """
+        :param item: accession to add
+        """
+        self.update([item])
+
+    def update(self, items: List[str]):
+        """
+        :param items: accessions to add
+        """
+        positions = self._positions(items)
+        np.bitwise_or.at(np.frombuffer(self.bits, dtype=np.uint8), positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def contains(self, items: List[str]) -> np.ndarray:
+        """
+        :param items: accessions
+        :return: boolean mask of the accessions that may be in the set
+        """
+        positions = self._positions(items)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)[positions >> np.uint64(3)]
+        return np.all(bits & np.left_shift(1, positions & np.uint64(7)).astype(np.uint8), axis=1)
+
+    def __contains__(self, item: str) -> bool:
+        return bool(self.contains([item])[0])
+
+    def save(self, file: str):
+        """
+        :param file: output file
+        """
+        with open(file, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(self.size, self.hashes, *self.source))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, file: str) -> 'BloomFilter':
+        """
+        :param file: file written by save
+        :return: filter
+        """
+        with open(file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(file + ' is not an accession filter of this version, rebuild it')
+            size, hashes, source_size, source_mtime = HEADER.unpack(f.read(HEADER.size))
+            bits = bytearray(f.read())
+        if len(bits) != ceil(size / 8):
+            raise ValueError(file + ' is truncated')
+        return cls(size, hashes, bits, (source_size, source_mtime))
+
+
+def hash_items(items: List[str]) -> np.ndarray:
+    """
+    Hash all items at once with FNV-1a over their bytes, followed by a finalizer to spread the bits
+
+    :param items: accessions
+    :return: array of 64-bit hashes
+    """
+    try:
+        encoded = np.array(items, dtype=bytes)
+    except UnicodeEncodeError:
+        # only ascii is encoded in bulk
+        encoded = np.array([item.encode() for item in items], dtype=bytes)
+    hashes = np.full(len(items), FNV_OFFSET, dtype=np.uint64)
+    if not encoded.itemsize:
+        return mix(hashes)
+    chars = encoded.view(np.uint8).reshape(len(items), encoded.itemsize).astype(np.uint64)
+    for column in chars.T:
+        # shorter items are padded with zeros, which leave their hash unchanged
+        hashes = np.where(column, (hashes ^ column) * FNV_PRIME, hashes)
+    return mix(hashes)
+
+
+def mix(hashes: np.ndarray) -> np.ndarray:
+    """
+    :param hashes: array of 64-bit hashes
+    :return: hashes passed through the finalizer of SplitMix64
+    """
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def filter_path(database_path: str) -> str:
+    """
+    :param database_path: path of megan_map.db
+    :return: path of the accession filter stored next to the database
+    """
+    return database_path + '.bloom'
+
+
+def database_stamp(database_path: str) -> Tuple[int, int]:
+    """
+    :param database_path: path of megan_map.db
+    :return: size and modification time in nanoseconds of the database, changed by any update of it
+    """
+    stat = os.stat(database_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_accession_filter(database_path: str, error_rate: float = 0.01) -> BloomFilter:
+    """
+    Build a filter over all accessions of megan_map.db and store it next to the database
+
+    :param database_path: path of megan_map.db
+    :param error_rate: false positive rate in (0, 1)
+    :return: filter
+    """
+    source = database_stamp(database_path)
+    connection = connect(database_path)
+    capacity = connection.execute('select count(*) from mappings').fetchone()[0]
+    bloom = BloomFilter.for_capacity(capacity, error_rate)
+    bloom.source = source
+    cursor = connection.execute('select Accession from mappings')
+    rows = cursor.fetchmany(BUILD_CHUNK)
+    while rows:
+        bloom.update([accession for accession, in rows])
+        rows = cursor.fetchmany(BUILD_CHUNK)
+    disconnect(connection)
+    bloom.save(filter_path(database_path))
+    return bloom
+
+
+def load_accession_filter(database_path: str) -> Optional[BloomFilter]:
+    """
+    Load the filter stored next to megan_map.db.
+    A filter built before the database was last changed could skip accessions that are present now, it is rejected.
+
+    :param database_path: path of megan_map.db
+    :return: filter or None if none was built
+    """
+    path = filter_path(database_path)
+    if not os.path.isfile(path):
+        return None
+    bloom = BloomFilter.load(path)
+    if bloom.source != database_stamp(database_path):
+        raise ValueError(path + ' was built from another version of ' + database_path + ', rebuild it')
+    return bloom
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build a filter of the accessions of megan_map.db stored next to it')
+    parser.add_argument('database_path')
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+    build_accession_filter(args.database_path, args.error_rate)
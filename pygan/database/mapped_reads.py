@@ -0,0 +1,111 @@
+from array import array
+from typing import List, Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+
+class MappedReads:
+    """
+    Compact representation of taxonomy ids per read
+
+    Holds all taxonomy ids in one flat integer array and the boundaries of each read in an offset array,
+    i.e. the taxonomy ids of read i are taxids[offsets[i]:offsets[i + 1]].
+    Behaves like a list of lists of taxonomy ids when indexed or iterated.
+    """
+
+    def __init__(self, taxids: np.ndarray, offsets: np.ndarray):
+        """
+        :param taxids: flat array of taxonomy ids of all reads
+        :param offsets: array of len(reads) + 1 read boundaries in taxids
+        """
+        self.taxids = taxids
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, reads: Iterable[Iterable[Optional[int]]]) -> 'MappedReads':
+        """
+        Build compact reads from lists of taxonomy ids, taxonomy ids that are None are dropped
+
+        :param reads: taxonomy ids per read
+        :return: compact reads
+        """
+        builder = MappedReadsBuilder()
+        for read in reads:
+            builder.append(read)
+        return builder.build()
+
+    def read(self, i: int) -> np.ndarray:
+        """
+        :param i: index of read
+        :return: view of the taxonomy ids of a read
+        """
+        return self.taxids[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: number of bytes held by the arrays
+        """
+        return self.taxids.nbytes + self.offsets.nbytes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> List[int]:
+        if i < 0:
+            i += len(self)
+        return self.read(i).tolist()
+
+    def __iter__(self) -> Iterator[List[int]]:
+        taxids = self.taxids
+        offsets = self.offsets.tolist()
+        for i in range(1, len(offsets)):
+            yield taxids[offsets[i - 1]:offsets[i]].tolist()
+
+
+class MappedReadsBuilder:
+    """
+    Append reads of taxonomy ids to growing buffers and convert them to compact reads once complete
+    """
+
+    def __init__(self):
+        self._taxids = array('q')
+        self._offsets = array('q', [0])
+
+    def append(self, read: Iterable[Optional[int]]):
+        """
+        :param read: taxonomy ids of a read, None is dropped
+        """
+        self._taxids.extend(taxid for taxid in read if taxid is not None)
+        self._offsets.append(len(self._taxids))
+
+    def extend(self, taxids: Sequence[Optional[int]], offsets: np.ndarray):
+        """
+        Append consecutive reads given in flat form
+
+        :param taxids: taxonomy ids of all reads, None is dropped
+        :param offsets: array of len(reads) + 1 read boundaries in taxids starting at 0
+        """
+        found = np.fromiter((taxid is not None for taxid in taxids), dtype=bool, count=len(taxids))
+        # number of taxonomy ids that are kept before every boundary
+        kept = np.zeros(len(taxids) + 1, dtype=np.int64)
+        np.cumsum(found, out=kept[1:])
+        base = len(self._taxids)
+        self._taxids.extend(taxid for taxid in taxids if taxid is not None)
+        self._offsets.extend((kept[offsets[1:]] + base).tolist())
+
+    def build(self) -> MappedReads:
+        """
+        Convert buffers to compact reads, taxonomy ids are stored as int32 if they fit
+
+        :return: compact reads
+        """
+        taxids = np.frombuffer(self._taxids, dtype=np.int64)
+        if taxids.size == 0 or (taxids.min() >= np.iinfo(np.int32).min and taxids.max() <= np.iinfo(np.int32).max):
+            taxids = taxids.astype(np.int32)
+        else:
+            taxids = taxids.copy()
+        offsets = np.frombuffer(self._offsets, dtype=np.int64).copy()
+        self._taxids = array('q')
+        self._offsets = array('q', [0])
+        return MappedReads(taxids, offsets)
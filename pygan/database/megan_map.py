@@ -1,20 +1,51 @@
 import sqlite3
 import os
-from typing import Dict, List, Iterable
+import warnings
+from pathlib import Path
+from typing import Dict, List, Iterable, Tuple, Optional
+
+from pygan.database.optimize import is_indexed, is_lookup_copy
+
+# upper bound of memory mapped database pages, sqlite clamps it to its compile time maximum
+MMAP_SIZE = 1 << 36
+# page cache per connection in KiB
+CACHE_SIZE = 1 << 18
 
 
 def connect(database_path: str) -> sqlite3.Connection:
     """
-    Connect to megan_map.db
+    Connect to megan_map.db in read-only mode with memory mapped pages and a large page cache.
+    Copies written by pygan.database.optimize or pygan.database.subset are opened as immutable,
+    which skips locking and change detection, other databases may be changed by other processes meanwhile.
+    Warns if accessions are not indexed, see pygan.database.optimize to prepare an optimized copy.
 
     :param database_path: path of megan_map.db
     :return: sqlite3 connection to megan_map.db
     """
     if not os.path.isfile(database_path):
         raise FileNotFoundError('Can not connect to ' + database_path)
-    connection = sqlite3.connect(database_path)
-    # raises sqlite3.OperationalError if Accession, Taxonomy or mappings does not exist
-    connection.execute('select Accession, Taxonomy from mappings limit 1')
+    connection = open_read_only(database_path)
+    # raises sqlite3.OperationalError if Accession or mappings does not exist
+    connection.execute('select Accession from mappings limit 1')
+    if is_lookup_copy(connection):
+        connection.close()
+        connection = open_read_only(database_path, immutable=True)
+    if not is_indexed(connection):
+        warnings.warn('Accession of ' + database_path + ' is not indexed, lookups scan the whole table',
+                      RuntimeWarning)
+    return connection
+
+
+def open_read_only(database_path: str, immutable: bool = False) -> sqlite3.Connection:
+    """
+    :param database_path: path of megan_map.db
+    :param immutable: assume that the database is never changed
+    :return: read-only sqlite3 connection with memory mapped pages and a large page cache
+    """
+    uri = Path(database_path).resolve().as_uri() + '?mode=ro' + ('&immutable=1' if immutable else '')
+    connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    connection.execute(f'pragma mmap_size = {MMAP_SIZE}')
+    connection.execute(f'pragma cache_size = -{CACHE_SIZE}')
     return connection
 
 
@@ -98,3 +129,33 @@ def map_accessions2ids(connection: sqlite3.Connection, accessions: Iterable[str]
     """
     prep = f'select Accession, {key} from mappings where Accession in (\''
     return {a: t for a, t in connection.execute(prep + '\',\''.join(accessions) + '\')')}
+
+
+def get_accessions2multiple_ids(database_path: str, accessions: Iterable[str], keys: List[str]) \
+        -> Dict[str, Tuple[Optional[int], ...]]:
+    """
+    Connect to megan_map.db and create a dictionary of accessions to ids of several keys
+
+    :param database_path: path of megan_map.db
+    :param accessions: collection of accessions to be mapped
+    :param keys: What the accession should be mapped to, e.g. ['Taxonomy', 'gtdb']
+    :return: dictionary of accessions to ids in order of keys
+    """
+    connection = connect(database_path)
+    accessions2ids = map_accessions2multiple_ids(connection, accessions, keys)
+    disconnect(connection)
+    return accessions2ids
+
+
+def map_accessions2multiple_ids(connection: sqlite3.Connection, accessions: Iterable[str], keys: List[str]) \
+        -> Dict[str, Tuple[Optional[int], ...]]:
+    """
+    Create a dictionary of accessions to ids of several keys with a single query
+
+    :param connection: sqlite3 connection to megan_map.db
+    :param accessions: collection of accessions to be mapped
+    :param keys: What the accession should be mapped to, e.g. ['Taxonomy', 'gtdb']
+    :return: dictionary of accessions to ids in order of keys
+    """
+    prep = f'select Accession, {", ".join(keys)} from mappings where Accession in (\''
+    return {row[0]: row[1:] for row in connection.execute(prep + '\',\''.join(accessions) + '\')')}
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+from argparse import ArgumentParser
+from typing import List
+
+
+def build_lookup_copy(database_path: str, target_path: str, keys: List[str]):
+    """
+    Write a copy of megan_map.db optimized for point lookups of accessions.
+    The copy only contains the requested keys in a WITHOUT ROWID table keyed on Accession,
+    is compacted and verified to resolve accessions by its primary key.
+
+    :param database_path: path of megan_map.db
+    :param target_path: path of the optimized copy, must not exist
+    :param keys: columns to keep, e.g. ['Taxonomy', 'gtdb']
+    """
+    if not os.path.isfile(database_path):
+        raise FileNotFoundError('Can not read ' + database_path)
+    if os.path.exists(target_path):
+        raise FileExistsError('Will not overwrite ' + target_path)
+    connection = sqlite3.connect(target_path)
+    try:
+        connection.execute('attach database ? as source', (database_path,))
+        columns = {row[1] for row in connection.execute('pragma source.table_info(mappings)')}
+        missing = [column for column in ['Accession', *keys] if column not in columns]
+        if missing:
+            raise ValueError('Columns ' + ', '.join(missing) + ' do not exist in ' + database_path)
+        create_lookup_table(connection, keys)
+        selection = ', '.join(['Accession', *keys])
+        connection.execute(f'insert or ignore into mappings ({selection}) '
+                           f'select {selection} from source.mappings where Accession is not null '
+                           f'order by Accession')
+        connection.commit()
+        connection.execute('detach database source')
+        # compact pages
+        connection.execute('vacuum')
+        if not is_indexed(connection):
+            raise RuntimeError('Accession of ' + target_path + ' is not indexed')
+    except BaseException:
+        connection.close()
+        os.remove(target_path)
+        raise
+    connection.close()
+
+
+def create_lookup_table(connection: sqlite3.Connection, keys: List[str]):
+    """
+    Create an empty mappings table keyed on Accession without row ids
+
+    :param connection: sqlite3 connection to the new database
+    :param keys: integer columns besides Accession
+    """
+    columns = ''.join(', ' + key + ' integer' for key in keys)
+    connection.execute(f'create table mappings (Accession text primary key not null{columns}) without rowid')
+
+
+def is_indexed(connection: sqlite3.Connection) -> bool:
+    """
+    Check whether accessions of megan_map.db are looked up by an index instead of a full scan
+
+    :param connection: sqlite3 connection to megan_map.db
+    :return: True if lookups of Accession use an index or primary key
+    """
+    plan = connection.execute('explain query plan select Accession from mappings where Accession = ?', ('',))
+    return all('SCAN' not in row[-1] for row in plan)
+
+
+
+def is_lookup_copy(connection: sqlite3.Connection) -> bool:
+    """
+    Check whether megan_map.db is a copy written by build_lookup_copy or extract_subset,
+    recognized by their mappings table without row ids. Such copies are not changed once written.
+
+    :param connection: sqlite3 connection to megan_map.db
+    :return: True if mappings is a WITHOUT ROWID table
+    """
+    row = connection.execute("select sql from sqlite_master where type = 'table' and name = 'mappings'").fetchone()
+    return row is not None and ' '.join(row[0].lower().split()).endswith('without rowid')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Write a copy of megan_map.db optimized for read-only lookups')
+    parser.add_argument('database_path')
+    parser.add_argument('target_path')
+    parser.add_argument('--keys', nargs='+', default=['Taxonomy'])
+    args = parser.parse_args()
+    build_lookup_copy(args.database_path, args.target_path, args.keys)
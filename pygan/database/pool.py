@@ -0,0 +1,54 @@
+import sqlite3
+from contextlib import contextmanager
+from queue import Queue
+from typing import Iterator
+
+from pygan.database.megan_map import connect, disconnect
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only connections to megan_map.db that can be shared by threads
+
+    Every connection is used by one thread at a time.
+    sqlite3 releases the GIL while a query executes, so threads can look up accessions concurrently.
+    """
+
+    def __init__(self, database_path: str, size: int):
+        """
+        :param database_path: path of megan_map.db
+        :param size: number of connections
+        """
+        self._connections: Queue = Queue()
+        self._all = []
+        for _ in range(size):
+            connection = connect(database_path)
+            self._all.append(connection)
+            self._connections.put(connection)
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection, blocks until one is available
+
+        :return: context manager yielding a connection
+        """
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        """
+        Close all connections of the pool
+        """
+        for connection in self._all:
+            disconnect(connection)
+        self._all = []
+
+    def __enter__(self) -> 'ConnectionPool':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+from argparse import ArgumentParser
+from typing import Dict, Set, Iterable
+
+from pygan.database.megan_map import connect, disconnect
+from pygan.database.optimize import create_lookup_table, is_indexed
+
+
+def collect_accessions(blast_files: Iterable[str], tab_map: Dict[str, int]) -> Set[str]:
+    """
+    Collect the distinct accessions of files in tab format
+
+    :param blast_files: filepaths
+    :param tab_map: contains a mapping of which column sseqid is in
+    :return: set of accessions
+    """
+    sseqid = tab_map['sseqid']
+    accessions = set()
+    for file in blast_files:
+        with open(file, 'r') as f:
+            for line in f:
+                accessions.add(line.split('\t', sseqid + 1)[sseqid].rstrip('\n')[:-2])
+    return accessions
+
+
+def extract_subset(database_path: str, blast_files: Iterable[str], tab_map: Dict[str, int], target_path: str,
+                   batch_size: int = 10000) -> int:
+    """
+    Write the mappings of all keys of the accessions occurring in a set of blast files to a small lookup database.
+    The subset has the layout of an optimized copy, see build_lookup_copy, and can be used in place of megan_map.db
+    for any analysis of these blast files.
+
+    :param database_path: path of megan_map.db
+    :param blast_files: paths of files containing blast data
+    :param tab_map: contains a mapping of which column sseqid is in
+    :param target_path: path of the subset, must not exist
+    :param batch_size: number of accessions to look up per query
+    :return: number of accessions in the subset
+    """
+    if os.path.exists(target_path):
+        raise FileExistsError('Will not overwrite ' + target_path)
+    accessions = sorted(collect_accessions(blast_files, tab_map))
+    source = connect(database_path)
+    keys = [row[1] for row in source.execute('pragma table_info(mappings)') if row[1] != 'Accession']
+    selection = ', '.join(['Accession', *keys])
+    target = sqlite3.connect(target_path)
+    try:
+        create_lookup_table(target, keys)
+        insert = f'insert or ignore into mappings ({selection}) values ({", ".join("?" * (len(keys) + 1))})'
+        for i in range(0, len(accessions), batch_size):
+            batch = accessions[i:i + batch_size]
+            rows = source.execute(f'select {selection} from mappings where Accession in '
+                                  f'({", ".join("?" * len(batch))})', batch)
+            target.executemany(insert, rows)
+        target.commit()
+        target.execute('vacuum')
+        if not is_indexed(target):
+            raise RuntimeError('Accession of ' + target_path + ' is not indexed')
+        extracted = target.execute('select count(*) from mappings').fetchone()[0]
+    except BaseException:
+        target.close()
+        os.remove(target_path)
+        raise
+    finally:
+        disconnect(source)
+    target.close()
+    return extracted
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Extract the mappings of the accessions of blast files from megan_map.db')
+    parser.add_argument('database_path')
+    parser.add_argument('target_path')
+    parser.add_argument('blast_files', nargs='+')
+    parser.add_argument('--sseqid', type=int, default=1, help='column of sseqid in the blast files')
+    args = parser.parse_args()
+    extract_subset(args.database_path, args.blast_files, {'sseqid': args.sseqid}, args.target_path)
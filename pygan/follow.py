@@ -0,0 +1,283 @@
+import os
+from sqlite3 import Connection
+from time import time, sleep, monotonic
+from typing import Dict, List, Optional
+
+from pygan.algorithms.lca import get_lca, LcaCache
+from pygan.blast.sharding import parse_filter_lines
+from pygan.database.megan_map import connect, disconnect
+from pygan.lca_analysis import parse_tree, compute_lca_addresses, lookup_segments, flatten_accessions, get_batcher, \
+    batch_reads, print_batches, post_process_assignments, write_results, timer
+from pygan.storage.result import LcaResult
+from pygan.tree.phylo_tree import PhyloTree
+
+# bytes of new blast data read per poll, the rest is read by the following polls
+POLL_BYTES = 1 << 26
+
+
+class BlastTail:
+    """
+    Reads the hits appended to a growing blast file in tab format
+
+    Only complete lines are read. The last read of the file is held back, as the aligner may still append hits to it,
+    and is read again by the next poll, so every other line is read once. Assumes that reads are continuous.
+    """
+
+    def __init__(self, file: str, tab_map: Dict[str, int], offset: int = 0):
+        """
+        :param file: filepath, may not exist yet
+        :param tab_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+        :param offset: byte offset of the first line to read
+        """
+        self.file = file
+        self.qseqid = tab_map['qseqid']
+        self.offset = offset
+
+    def poll(self, final: bool = False, max_bytes: int = POLL_BYTES) -> List[bytes]:
+        """
+        :param final: whether the file is complete, then the last read is not held back
+        :param max_bytes: bytes of new data to read at most, exceeded only by a single read that does not fit
+        :return: lines of whole reads appended since the last poll
+        """
+        while True:
+            try:
+                with open(self.file, 'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read(max_bytes)
+            except FileNotFoundError:
+                return []
+            complete = final and len(data) < max_bytes
+            lines = data[:len(data) if complete else data.rfind(b'\n') + 1].splitlines(keepends=True)
+            if not lines or complete:
+                break
+            # hold back the lines of the last read
+            qseqid = self.qseqid
+            read_id = lines[-1].split(b'\t')[qseqid]
+            n = len(lines) - 1
+            while n > 0 and lines[n - 1].split(b'\t')[qseqid] == read_id:
+                n -= 1
+            if n > 0 or len(data) < max_bytes:
+                lines = lines[:n]
+                break
+            # a single read exceeds max_bytes
+            max_bytes *= 2
+        self.offset += sum(map(len, lines))
+        return lines
+
+
+class LiveClassifier:
+    """
+    LCA assignments of a sample that grows by batches of reads
+
+    Every batch is looked up and assigned once, the assignments so far are kept per taxon.
+    Snapshots post-process them on a pruned working tree, so neither the assignments nor the tree are modified
+    and classification continues after every snapshot.
+    """
+
+    def __init__(self, tree: PhyloTree, id2address: Dict, address2id: Dict, megan_map_file: str,
+                 db_segment_size: int, db_key: str, ignore_ancestors: bool, min_support: int, only_major: bool,
+                 exclude: List[str], project_mode: str, project_rank: str, cluster_degree: int,
+                 connection: Optional[Connection] = None, lca_cache: Optional[LcaCache] = None):
+        """
+        :param tree: phylogenetic tree
+        :param id2address: mapping of taxonomy id to its address in the tree
+        :param address2id: mapping of a tree address to its taxonomy id
+        :param megan_map_file: path to file containing megan_map.db
+        :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+            0 to size chunks adaptively
+        :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+        :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+        :param min_support: limit for the minimum support filter algorithm
+        :param only_major: only major ranks are allowed to retain reads
+        :param exclude: ranks that the minimum support filter should not be applied to
+        :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+        :param project_rank: target rank to project reads to
+        :param cluster_degree: degree to cluster hits by during the accession-based projection
+        :param connection: open sqlite3 connection to megan_map.db to reuse
+        :param lca_cache: memo of LCAs of the tree
+        """
+        self.tree = tree
+        self.id2address = id2address
+        self.address2id = address2id
+        self.megan_map_file = megan_map_file
+        self.db_segment_size = db_segment_size
+        self.db_key = db_key
+        self.ignore_ancestors = ignore_ancestors
+        self.min_support = min_support
+        self.only_major = only_major
+        self.exclude = exclude
+        self.project_mode = project_mode
+        self.project_rank = project_rank
+        self.cluster_degree = cluster_degree
+        self.connection = connection
+        self.lca_cache = lca_cache
+        self.batcher = get_batcher(db_segment_size)
+        self.assignments: Dict[int, List[str]] = {}
+        # accession projection needs the mapped taxons of all reads
+        self.keep_mapped_reads = project_mode in ('accession', 'mixed')
+        self.mapped_reads: List[List[int]] = []
+        self.read_ids: List[str] = []
+        self.reads = 0
+
+    def update(self, reads: List[List[str]], read_ids: List[str]):
+        """
+        Look up and assign a batch of new reads
+
+        :param reads: list of accessions per read filtered by top score percentage
+        :param read_ids: list of read ids corresponding to reads
+        """
+        mapped_reads = []
+        for grouped_reads, acc2id, _ in lookup_segments(batch_reads(reads, self.db_segment_size, self.batcher),
+                                                        flatten_accessions, self.megan_map_file, self.db_key,
+                                                        self.connection, batcher=self.batcher):
+            for read in grouped_reads:
+                mapped_reads.append([acc2id[acc] for acc in read if acc in acc2id])
+        assignments = self.assignments
+        for read, read_id in zip(mapped_reads, read_ids):
+            if self.lca_cache:
+                tax_id = self.lca_cache.get_lca(read, self.ignore_ancestors)
+            else:
+                tax_id = get_lca(read, self.id2address, self.address2id, self.ignore_ancestors)
+            if tax_id in assignments:
+                assignments[tax_id].append(read_id)
+            else:
+                assignments[tax_id] = [read_id]
+        if self.keep_mapped_reads:
+            self.mapped_reads += mapped_reads
+            self.read_ids += read_ids
+        self.reads += len(read_ids)
+
+    def snapshot(self, keep_reads: bool = False) -> LcaResult:
+        """
+        :param keep_reads: keep read ids in the result, else only counts
+        :return: post-processed result of all reads so far
+        """
+        return post_process_assignments(self.tree, self.assignments, self.mapped_reads, self.read_ids,
+                                        self.min_support, self.only_major, self.exclude, self.project_mode,
+                                        self.project_rank, self.cluster_degree, keep_reads)
+
+
+def follow(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
+           blast_map: Dict[str, int], top_score_percent: float,
+           db_segment_size: int, db_key: str,
+           ignore_ancestors: bool, min_support: int, only_major: bool,
+           exclude: List[str], project_mode: str, project_rank: str,
+           cluster_degree: int, out_file: str,
+           prefix_rank: bool, show_path: bool, list_reads: bool,
+           report_interval: float = 60, poll_interval: float = 1, idle_timeout: float = 0,
+           lca_cache_size: int = 0) -> LcaResult:
+    """
+    Performs an LCA analysis of a blast file while the aligner is still appending to it.
+
+    Only reads completed since the last poll are parsed, looked up and assigned, so every read is processed once.
+    The report in out_file is replaced with the post-processed result of all reads so far whenever report_interval
+    seconds passed and new reads were assigned. Following stops once the file has not grown for idle_timeout seconds
+    or on KeyboardInterrupt, then the last read is assigned and the final report is written.
+
+    :param tre_file: path to file containing tree in Newick format
+    :param map_file: path to file containing the mapping of tax ids to tax names and ranks
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing continuous blast data, may not exist yet
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param out_file: path to output file, replaced by every report
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param list_reads: display read ids mapped to nodes (else display number of reads)
+    :param report_interval: minimum seconds between reports
+    :param poll_interval: seconds to wait for the file to grow
+    :param idle_timeout: seconds without growth of the file to stop after, 0 to follow until interrupted
+    :param lca_cache_size: maximum number of distinct sets of taxons per read whose LCA is memoized, 0 to disable
+    :return: result of the final report
+    """
+
+    print('starting live lca analysis')
+    start = time()
+    tree = parse_tree(tre_file, map_file)
+    id2address, address2id = compute_lca_addresses(tree)
+    lca_cache = LcaCache(id2address, address2id, lca_cache_size) if lca_cache_size else None
+    connection = connect(megan_map_file)
+    try:
+        classifier = LiveClassifier(tree, id2address, address2id, megan_map_file, db_segment_size, db_key,
+                                    ignore_ancestors, min_support, only_major, exclude, project_mode, project_rank,
+                                    cluster_degree, connection, lca_cache)
+        tail = BlastTail(blast_file, blast_map)
+        reported = 0
+        last_report = last_growth = monotonic()
+        size = -1
+        try:
+            while True:
+                lines = tail.poll()
+                if lines:
+                    classify_lines(classifier, lines, top_score_percent, blast_map)
+                else:
+                    next_size = os.path.getsize(blast_file) if os.path.exists(blast_file) else -1
+                    if next_size != size:
+                        size = next_size
+                        last_growth = monotonic()
+                    elif idle_timeout and monotonic() - last_growth >= idle_timeout:
+                        break
+                    sleep(poll_interval)
+                if classifier.reads > reported and monotonic() - last_report >= report_interval:
+                    write_report(tree, classifier.snapshot(list_reads), out_file, prefix_rank, show_path, list_reads)
+                    reported = classifier.reads
+                    last_report = monotonic()
+        except KeyboardInterrupt:
+            print('stopped following ' + blast_file)
+        # read the rest, including the last read
+        lines = tail.poll(final=True)
+        while lines:
+            classify_lines(classifier, lines, top_score_percent, blast_map)
+            lines = tail.poll(final=True)
+        result = classifier.snapshot(list_reads)
+        write_report(tree, result, out_file, prefix_rank, show_path, list_reads)
+        print_batches(classifier.batcher)
+    finally:
+        disconnect(connection)
+
+    print('finished live lca analysis of ' + str(classifier.reads) + ' reads in ' + timer(start))
+    return result
+
+
+def classify_lines(classifier: LiveClassifier, lines: List[bytes], top_score_percent: float,
+                   blast_map: Dict[str, int]):
+    """
+    Parse and assign lines of whole reads
+
+    :param classifier: classifier of the sample
+    :param lines: lines of whole reads in tab format
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    """
+    t = time()
+    reads, read_ids = parse_filter_lines(lines, top_score_percent, blast_map)
+    classifier.update(reads, read_ids)
+    print('classified ' + str(len(read_ids)) + ' new reads, ' + str(classifier.reads) + ' in total, in ' + timer(t))
+
+
+def write_report(tree: PhyloTree, result: LcaResult, out_file: str, prefix_rank: bool, show_path: bool,
+                 list_reads: bool):
+    """
+    Replace the report in out_file at once, so readers never see a partial report
+
+    :param tree: phylogenetic tree, left without reads
+    :param result: post-processed result
+    :param out_file: path to output file
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param list_reads: display read ids mapped to nodes (else display number of reads)
+    """
+    result.to_tree(tree)
+    write_results(tree, out_file + '.tmp', prefix_rank, show_path, list_reads)
+    tree.clear_reads()
+    os.replace(out_file + '.tmp', out_file)
@@ -1,21 +1,57 @@
-from typing import Dict, Tuple, List, Any
+from typing import Dict, Tuple, List, Any, Optional, Iterable, Iterator, Callable, Set, TextIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pickle import dump, load
-from time import time
+from functools import reduce
+from math import ceil
+from sqlite3 import Connection
+from time import time, perf_counter
 from pygan.tree.phylo_tree import PhyloTree
 from pygan.tree.newick_parser import get_phylo_tree
 from pygan.tree.map_parser import map_names
+from pygan.tree.prune import prune, restore
 from pygan.blast.blast_parser import parse_filter, parse_with_score, filter_by_top_score
-from pygan.database.megan_map import get_accessions2taxonids
-from pygan.algorithms.lca import compute_addresses, get_common_prefix
+from pygan.blast.grouping import parse_filter_unsorted, parse_with_score_unsorted
+from pygan.blast.score_array import ScoreArray, parse_score_array, filter_score_array, slice_score_array, to_reads
+from pygan.blast.fast_parser import parse_filter_mmap
+from pygan.blast.hit_limit import HitLimit
+from pygan.blast.sampling import parse_filter_sample
+from pygan.database.megan_map import get_accessions2taxonids, map_accessions2ids, get_accessions2multiple_ids, \
+    map_accessions2multiple_ids
+from pygan.database.optimize import build_lookup_copy
+from pygan.database.subset import extract_subset
+from pygan.database.bloom import BloomFilter, load_accession_filter
+from pygan.database.pool import ConnectionPool
+from pygan.database.batching import AdaptiveBatcher
+from pygan.database.mapped_reads import MappedReads, MappedReadsBuilder
+from pygan.algorithms.lca import compute_addresses, get_lca, LcaCache
 from pygan.algorithms.min_sup_filter import apply
+from pygan.algorithms.summary import SubtreeSummary
+from pygan.algorithms.estimate import Estimate, estimate_counts
 from pygan.algorithms.projection import project_proportional, project_accession, project_accession_proportional
+from pygan.storage.spill import SpillList
+from pygan.storage.result import LcaResult
+from pygan.storage.read_index import save_read_index
+
+# post-processing parameters of a sweep configuration that may be omitted
+SWEEP_DEFAULTS = {
+    'project_mode': '',
+    'project_rank': '',
+    'cluster_degree': 0,
+    'min_support': 0,
+    'exclude': [],
+    'only_major': False
+}
 
 
 def run(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
         blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int, db_key: str,
         ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
         project_mode: str, project_rank: str, cluster_degree: int,
-        out_file: str, prefix_rank: bool, show_path: bool, list_reads: bool):
+        out_file: str, prefix_rank: bool, show_path: bool, list_reads: bool, memory_budget: int = 0,
+        compact_reads: bool = False, unsorted_memory: int = 0, use_accession_filter: bool = False,
+        db_threads: int = 0, fast_parser: bool = False, assignments_file: str = '', max_hits: int = 0,
+        min_bitscore: float = 0, lca_cache_size: int = 0, read_index_file: str = ''):
     """
     Performs an LCA analysis
 
@@ -32,7 +68,8 @@ def run(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
     :param blast_file: path to file containing blast data
     :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
     :param top_score_percent: percentage in [0, 1] to filter accessions by
-    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
     :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
     :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
     :param min_support: limit for the minimum support filter algorithm
@@ -45,21 +82,230 @@ def run(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
     :param prefix_rank: add an abbreviation of the rank to the name
     :param show_path: show paths from root to nodes
     :param list_reads: display read ids mapped to nodes (else display number of reads)
+    :param memory_budget: maximum number of hits held in memory per list of reads before spilling to disk, 0 to disable,
+        read ids are spilled as well and nodes only count their reads if their ids are not needed
+    :param compact_reads: store taxonomy ids of all reads in one flat array instead of one list per read
+    :param unsorted_memory: bytes of blast data grouped in memory at once if hits of a read are not continuous,
+        0 if they are
+    :param use_accession_filter: skip accessions missing from megan_map.db according to the filter stored next to it
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param fast_parser: parse continuous blast data from a memory map in blocks, ignored with a memory budget
+    :param assignments_file: path to output file of the final taxonomy id of every read, '' to skip
+    :param max_hits: maximum number of best scoring hits kept per read while parsing, 0 to keep all
+    :param min_bitscore: minimum bit score of hits kept while parsing, 0 to keep all
+    :param lca_cache_size: maximum number of distinct sets of taxons per read whose LCA is memoized, 0 to disable
+    :param read_index_file: path to write an index of the read ids per taxon to, see write_read_index
     """
 
     print('starting lca analysis')
     lca_start = time()
     tree = parse_tree(tre_file, map_file)
     id2address, address2id = compute_lca_addresses(tree)
-    reads, read_ids = parse_blast_filter(blast_file, top_score_percent, blast_map)
-    mapped_reads = map_accessions(reads, megan_map_file, db_segment_size, db_key)
-    map_lcas(tree, id2address, address2id, mapped_reads, read_ids, ignore_ancestors)
-    project_reads_to_rank(project_mode, tree, project_rank, mapped_reads, read_ids, cluster_degree)
-    apply_min_sup_filter(tree, min_support, exclude, only_major)
+    accession_filter = load_megan_map_filter(megan_map_file) if use_accession_filter else None
+    lca_cache = LcaCache(id2address, address2id, lca_cache_size) if lca_cache_size else None
+    assignments = open(assignments_file, 'w') if assignments_file else None
+    try:
+        classify_sample(tree, id2address, address2id, megan_map_file, blast_file, blast_map, top_score_percent,
+                        db_segment_size, db_key, ignore_ancestors, min_support, only_major, exclude,
+                        project_mode, project_rank, cluster_degree, memory_budget=memory_budget,
+                        compact_reads=compact_reads, unsorted_memory=unsorted_memory,
+                        accession_filter=accession_filter, db_threads=db_threads, fast_parser=fast_parser,
+                        assignments=assignments, max_hits=max_hits, min_bitscore=min_bitscore,
+                        lca_cache=lca_cache, list_reads=list_reads or bool(read_index_file))
+    finally:
+        if assignments:
+            assignments.close()
     write_results(tree, out_file, prefix_rank, show_path, list_reads)
+    if read_index_file:
+        write_read_index(tree, read_index_file)
     print('completed lca analysis in ' + timer(lca_start))
 
 
+def run_multi(taxonomies: Dict[str, Tuple[str, str, str]], megan_map_file: str, blast_file: str,
+              blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int,
+              ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
+              project_mode: str, project_rank: str, cluster_degree: int,
+              prefix_rank: bool, show_path: bool, list_reads: bool, use_accession_filter: bool = False):
+    """
+    Performs an LCA analysis of one blast file against several taxonomies, e.g. NCBI and GTDB.
+    The blast file is parsed once and all keys are mapped via the database in a single pass,
+    then reads are assigned, post-processed and written per taxonomy.
+
+    :param taxonomies: db_key to (tre_file, map_file, out_file) of every taxonomy,
+        e.g. {'Taxonomy': ('ncbi.tre', 'ncbi.map', 'ncbi.txt'), 'gtdb': ('gtdb.tre', 'gtdb.map', 'gtdb.txt')}
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param list_reads: display read ids mapped to nodes (else display number of reads)
+    :param use_accession_filter: skip accessions missing from megan_map.db according to the filter stored next to it
+    """
+
+    print('starting multi taxonomy lca analysis')
+    lca_start = time()
+    accession_filter = load_megan_map_filter(megan_map_file) if use_accession_filter else None
+    reads, read_ids = parse_blast_filter(blast_file, top_score_percent, blast_map)
+    db_keys = list(taxonomies.keys())
+    mapped_reads = map_accessions_multi(reads, megan_map_file, db_segment_size, db_keys,
+                                        accession_filter=accession_filter)
+    del reads
+    for db_key, (tre_file, map_file, out_file) in taxonomies.items():
+        tree = parse_tree(tre_file, map_file)
+        id2address, address2id = compute_lca_addresses(tree)
+        occupied = map_lcas(tree, id2address, address2id, mapped_reads[db_key], read_ids, ignore_ancestors)
+        post_process(tree, occupied, project_mode, project_rank, mapped_reads[db_key], read_ids, cluster_degree,
+                     min_support, exclude, only_major)
+        write_results(tree, out_file, prefix_rank, show_path, list_reads)
+        # release mapping and tree of this taxonomy before preparing the next one
+        del mapped_reads[db_key]
+    print('completed multi taxonomy lca analysis in ' + timer(lca_start))
+
+
+def run_preview(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
+                blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int, db_key: str,
+                ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
+                project_mode: str, project_rank: str, cluster_degree: int,
+                out_file: str, prefix_rank: bool, show_path: bool, sample_fraction: float = 0.01,
+                sample_size: int = 0, confidence: float = 0.95, seed: Optional[int] = None) -> Dict[int, Estimate]:
+    """
+    Performs an approximate LCA analysis of a uniform random sample of the reads of a blast file.
+    Only sampled reads are looked up and assigned, their counts are scaled to the whole sample.
+    The minimum support is scaled to the sample as well and rounded up.
+
+    :param tre_file: path to file containing tree in Newick format
+    :param map_file: path to file containing the mapping of tax ids to tax names and ranks
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing continuous blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm on the whole sample
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param out_file: path to output file
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param sample_fraction: probability in (0, 1] of a read to be sampled
+    :param sample_size: number of reads to sample, takes precedence over sample_fraction
+    :param confidence: confidence level of the intervals in (0, 1)
+    :param seed: seed of the random generator, random if None
+    :return: estimate per taxonomy id
+    """
+
+    print('starting preview lca analysis')
+    lca_start = time()
+    tree = parse_tree(tre_file, map_file)
+    id2address, address2id = compute_lca_addresses(tree)
+    reads, read_ids, total = parse_blast_sample(blast_file, top_score_percent, blast_map, sample_fraction,
+                                                sample_size, seed)
+    mapped_reads = map_accessions(reads, megan_map_file, db_segment_size, db_key)
+    del reads
+    occupied = map_lcas(tree, id2address, address2id, mapped_reads, read_ids, ignore_ancestors)
+    # the filter takes whole reads and skips supports below 2, a fraction is rounded up
+    sampled_support = ceil(min_support * len(read_ids) / total) if total else min_support
+    post_process(tree, occupied, project_mode, project_rank, mapped_reads, read_ids, cluster_degree,
+                 sampled_support, exclude, only_major)
+    counts = {node.tax_id: len(node.reads) for node in tree.nodes.values() if node.reads}
+    estimates = estimate_counts(counts, len(read_ids), total, confidence)
+    write_estimates(tree, estimates, out_file, prefix_rank, show_path)
+    print('completed preview lca analysis in ' + timer(lca_start))
+    return estimates
+
+
+def classify_sample(tree: PhyloTree, id2address: Dict, address2id: Dict, megan_map_file: str, blast_file: str,
+                    blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int, db_key: str,
+                    ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
+                    project_mode: str, project_rank: str, cluster_degree: int,
+                    connection: Optional[Connection] = None, memory_budget: int = 0, compact_reads: bool = False,
+                    unsorted_memory: int = 0, accession_filter: Optional[BloomFilter] = None, db_threads: int = 0,
+                    fast_parser: bool = False, assignments: Optional[TextIO] = None, max_hits: int = 0,
+                    min_bitscore: float = 0, lca_cache: Optional[LcaCache] = None, list_reads: bool = True):
+    """
+    Performs the per-sample stages of an LCA analysis on a prepared phylogenetic tree
+
+    Reads mapped by a previous sample are removed first, so a tree and its addresses
+    can be prepared once and reused for any number of samples.
+
+    :param tree: phylogenetic tree
+    :param id2address: mapping of taxonomy id to its address in the tree
+    :param address2id: mapping of a tree address to its taxonomy id
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param memory_budget: maximum number of hits held in memory per list of reads before spilling to disk, 0 to disable,
+        read ids are spilled as well
+    :param compact_reads: store taxonomy ids of all reads in one flat array instead of one list per read
+    :param unsorted_memory: bytes of blast data grouped in memory at once if hits of a read are not continuous,
+        0 if they are
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param fast_parser: parse continuous blast data from a memory map in blocks, ignored with a memory budget
+    :param assignments: open text file to stream the final taxonomy id of every read to
+    :param max_hits: maximum number of best scoring hits kept per read while parsing, 0 to keep all
+    :param min_bitscore: minimum bit score of hits kept while parsing, 0 to keep all
+    :param lca_cache: memo of LCAs of the tree, may be kept across samples
+    :param list_reads: read ids of nodes are needed after classification, else only their number is kept
+        with a memory budget unless they are projected by accession or streamed to assignments
+    """
+    # with a memory budget, nodes hold no read ids that are not needed
+    tree.clear_reads(bool(memory_budget) and not list_reads and assignments is None and
+                     project_mode not in ('accession', 'mixed'))
+    hit_limit = HitLimit(max_hits, min_bitscore) if max_hits or min_bitscore else None
+    if fast_parser and not memory_budget and not unsorted_memory:
+        # reads stay in flat form until they are mapped
+        score_array, read_ids = parse_blast_filter_mmap(blast_file, top_score_percent, blast_map, hit_limit)
+        mapped_reads = map_score_array(score_array, megan_map_file, db_segment_size, db_key, connection,
+                                       accession_filter, db_threads)
+        # accessions are not needed anymore
+        del score_array
+    else:
+        reads, read_ids = parse_blast_filter(blast_file, top_score_percent, blast_map, memory_budget,
+                                             unsorted_memory, hit_limit)
+        if compact_reads:
+            mapped_reads = map_accessions_compact(reads, megan_map_file, db_segment_size, db_key, connection,
+                                                  accession_filter, db_threads)
+        else:
+            mapped_reads = map_accessions(reads, megan_map_file, db_segment_size, db_key, connection,
+                                          memory_budget, accession_filter, db_threads)
+        # accessions are not needed anymore
+        del reads
+    # assignments are final after LCA unless reads are post-processed
+    post_processed = is_post_processed(project_mode, min_support, only_major)
+    occupied = map_lcas(tree, id2address, address2id, mapped_reads, read_ids, ignore_ancestors,
+                        None if post_processed else assignments, lca_cache)
+    post_process(tree, occupied, project_mode, project_rank, mapped_reads, read_ids, cluster_degree,
+                 min_support, exclude, only_major, assignments)
+
+
 def parse_tree(tre_file: str, map_file: str) -> PhyloTree:
     """
     Parse a phylogenetic tree from a newick format file
@@ -94,37 +340,104 @@ def compute_lca_addresses(tree: PhyloTree) -> Tuple[Dict, Dict]:
     return id2address, address2id
 
 
-def parse_blast_filter(blast_file: str, top_score_percent: float, blast_map: Dict[str, int]) \
-        -> Tuple[List[List[str]], List[str]]:
+def parse_blast_filter(blast_file: str, top_score_percent: float, blast_map: Dict[str, int],
+                       memory_budget: int = 0, unsorted_memory: int = 0,
+                       hit_limit: Optional[HitLimit] = None) -> Tuple[List[List[str]], List[str]]:
     """
     Parse a blast tab file and filter the accessions by top score
 
     :param blast_file: path to file containing blast data
     :param top_score_percent: percentage in [0, 1] to filter accessions by
     :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param memory_budget: maximum number of accessions and read ids held in memory before spilling to disk, 0 to disable
+    :param unsorted_memory: bytes of blast data grouped in memory at once if hits of a read are not continuous,
+        0 if they are
+    :param hit_limit: limits hits per read by count and bit score before the top score filter
     :return: list of accessions per read filtered by top score, list of read ids
     """
     t = time()
-    reads_n_read_ids = parse_filter(blast_file, top_score_percent, blast_map)
+    if unsorted_memory:
+        reads_n_read_ids = parse_filter_unsorted(blast_file, top_score_percent, blast_map, unsorted_memory,
+                                                 memory_budget, hit_limit=hit_limit)
+    else:
+        reads_n_read_ids = parse_filter(blast_file, top_score_percent, blast_map, memory_budget, hit_limit)
+    print_dropped(hit_limit)
     print('parsed blast in ' + timer(t))
     return reads_n_read_ids
 
 
-def parse_blast_with_score(blast_file: str, blast_map: Dict[str, int]) \
-        -> Tuple[List[List[Tuple[str, float]]], List[str]]:
+def parse_blast_filter_mmap(blast_file: str, top_score_percent: float, blast_map: Dict[str, int],
+                            hit_limit: Optional[HitLimit] = None) -> Tuple[ScoreArray, List[str]]:
+    """
+    Parse a blast tab file from a memory map and filter the accessions by top score
+
+    :param blast_file: path to file containing continuous blast data
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param hit_limit: limits hits per read by count and bit score before the top score filter
+    :return: accessions filtered by top score with scores and offsets per read, list of read ids
+    """
+    t = time()
+    score_array_n_read_ids = parse_filter_mmap(blast_file, top_score_percent, blast_map, hit_limit)
+    print_dropped(hit_limit)
+    print('parsed blast in ' + timer(t))
+    return score_array_n_read_ids
+
+
+def parse_blast_with_score(blast_file: str, blast_map: Dict[str, int], unsorted_memory: int = 0,
+                           hit_limit: Optional[HitLimit] = None) -> Tuple[List[List[Tuple[str, float]]], List[str]]:
     """
     Parse a blast tab file with scores
 
     :param blast_file: path to file containing blast data
     :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param unsorted_memory: bytes of blast data grouped in memory at once if hits of a read are not continuous,
+        0 if they are
+    :param hit_limit: limits hits per read by count and bit score
     :return: list of accessions with score per read, list of read ids
     """
     t = time()
-    reads_ws_n_read_ids = parse_with_score(blast_file, blast_map)
+    if unsorted_memory:
+        reads_ws_n_read_ids = parse_with_score_unsorted(blast_file, blast_map, unsorted_memory, hit_limit=hit_limit)
+    else:
+        reads_ws_n_read_ids = parse_with_score(blast_file, blast_map, hit_limit)
+    print_dropped(hit_limit)
     print('parsed blast with score in ' + timer(t))
     return reads_ws_n_read_ids
 
 
+def parse_blast_sample(blast_file: str, top_score_percent: float, blast_map: Dict[str, int],
+                       sample_fraction: float = 0, sample_size: int = 0, seed: Optional[int] = None) \
+        -> Tuple[List[List[str]], List[str], int]:
+    """
+    Parse a uniform random sample of the reads of a blast tab file and filter their accessions by top score
+
+    :param blast_file: path to file containing continuous blast data
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param sample_fraction: probability in (0, 1] of a read to be sampled
+    :param sample_size: number of reads to sample, takes precedence over sample_fraction
+    :param seed: seed of the random generator, random if None
+    :return: list of accessions per sampled read filtered by top score, list of sampled read ids, number of reads
+    """
+    t = time()
+    reads, read_ids, total = parse_filter_sample(blast_file, top_score_percent, blast_map, sample_fraction,
+                                                 sample_size, seed)
+    print('sampled ' + str(len(read_ids)) + ' of ' + str(total) + ' reads')
+    print('parsed blast sample in ' + timer(t))
+    return reads, read_ids, total
+
+
+def print_dropped(hit_limit: Optional[HitLimit]):
+    """
+    Report the number of hits dropped by a hit limit
+
+    :param hit_limit: hit limit that was used, nothing is reported if None
+    """
+    if hit_limit is not None:
+        print('dropped #hits by hit limit: ' + str(hit_limit.dropped))
+
+
 def filter_reads_by_top_score(reads_ws: List[List[Tuple[Any, float]]], top_score_percent: float) -> List[List[Any]]:
     """
     Filter items in read by the top score percentage.
@@ -142,88 +455,634 @@ def filter_reads_by_top_score(reads_ws: List[List[Tuple[Any, float]]], top_score
     return reads
 
 
-def map_accessions(reads: List[List[str]], megan_map_file: str, db_segment_size: int, db_key: str) -> List[List[int]]:
+def parse_blast_score_array(blast_file: str, blast_map: Dict[str, int]) -> Tuple[ScoreArray, List[str]]:
+    """
+    Parse a blast tab file into a flat array of scores with per-read offsets.
+    The result can be filtered repeatedly with different percentages by filter_score_array_by_top_score.
+
+    :param blast_file: path to file containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :return: accessions with scores and offsets per read, list of read ids
+    """
+    t = time()
+    score_array_n_read_ids = parse_score_array(blast_file, blast_map)
+    print('parsed blast to score array in ' + timer(t))
+    return score_array_n_read_ids
+
+
+def filter_score_array_by_top_score(score_array: ScoreArray, top_score_percent: float) -> List[List[str]]:
+    """
+    Filter accessions of all reads by the top score percentage in a vectorized manner.
+    An accession within the percentage of the top score stays in the read.
+
+    :param score_array: accessions with scores and offsets per read
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :return: list of accessions per read filtered by top score
+    """
+    t = time()
+    reads = to_reads(filter_score_array(score_array, top_score_percent))
+    print('filtered score array by top score in ' + timer(t))
+    return reads
+
+
+def optimize_megan_map(megan_map_file: str, out_file: str, db_keys: List[str]):
+    """
+    Write a compacted read-only lookup copy of megan_map.db keyed on Accession that only contains the given keys
+
+    :param megan_map_file: path to file containing megan_map.db
+    :param out_file: path of the optimized copy
+    :param db_keys: keys to keep (Taxonomy for NCBI, gtdb for GTDB)
+    """
+    t = time()
+    build_lookup_copy(megan_map_file, out_file, db_keys)
+    print('optimized megan map in ' + timer(t))
+
+
+def extract_megan_map_subset(megan_map_file: str, blast_files: List[str], blast_map: Dict[str, int], out_file: str):
+    """
+    Write the mappings of all accessions occurring in a set of blast files to a small lookup database
+    that can be used in place of megan_map.db when analysing these files
+
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_files: paths to files containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param out_file: path of the subset
+    """
+    t = time()
+    extracted = extract_subset(megan_map_file, blast_files, blast_map, out_file)
+    print('extracted #accessions: ' + str(extracted) + ' in ' + timer(t))
+
+
+def map_accessions(reads: List[List[str]], megan_map_file: str, db_segment_size: int, db_key: str,
+                   connection: Optional[Connection] = None, memory_budget: int = 0,
+                   accession_filter: Optional[BloomFilter] = None, db_threads: int = 0,
+                   batcher: Optional[AdaptiveBatcher] = None) -> List[List[int]]:
     """
     Retrieve taxonomy ids for every read from the Megan Map Database
 
     :param reads: list of accessions per read
     :param megan_map_file: path to file containing megan_map.db
-    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
     :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param memory_budget: maximum number of taxonomy ids held in memory before spilling to disk, 0 to disable
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param batcher: sizes chunks by distinct accessions and tunes them from measured lookups instead of
+        db_segment_size, created with default bounds if db_segment_size is 0
     :return: list of taxonomy ids per read
     """
     t = time()
-    mapped_reads = []
-    # compute indices for segmentation
-    segments = [*range(0, len(reads), db_segment_size), len(reads)]
-    for i in range(1, len(segments)):
-        # group reads into chunks
-        grouped_reads = reads[segments[i - 1]:segments[i]]
-        # collect all accessions from a chunk of reads
-        flattened_reads = [acc for read in grouped_reads for acc in read]
-        # map accessions to taxons
-        acc2id = get_accessions2taxonids(megan_map_file, flattened_reads, db_key)
+    mapped_reads = SpillList(memory_budget) if memory_budget else []
+    filtered = 0
+    batcher = get_batcher(db_segment_size, batcher)
+    # group reads into chunks and map their accessions to taxons
+    for grouped_reads, acc2id, skipped in lookup_segments(batch_reads(reads, db_segment_size, batcher),
+                                                          flatten_accessions, megan_map_file, db_key, connection,
+                                                          accession_filter, db_threads, batcher):
+        filtered += skipped
         # dechunk reads again
         for read in grouped_reads:
             mapped_reads.append([acc2id[acc] for acc in read if acc in acc2id])
+    print_filtered(filtered, accession_filter)
+    print_batches(batcher)
     print('mapped #reads: ' + str(len(reads)) + ' in ' + timer(t))
     return mapped_reads
 
 
+def map_accessions_compact(reads: Iterable[List[str]], megan_map_file: str, db_segment_size: int, db_key: str,
+                           connection: Optional[Connection] = None,
+                           accession_filter: Optional[BloomFilter] = None, db_threads: int = 0,
+                           batcher: Optional[AdaptiveBatcher] = None) -> MappedReads:
+    """
+    Retrieve taxonomy ids for every read from the Megan Map Database
+    and store them in one flat array with per-read offsets.
+    The result can be used wherever a list of taxonomy ids per read is expected.
+
+    :param reads: list of accessions per read
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param batcher: sizes chunks by distinct accessions and tunes them from measured lookups instead of
+        db_segment_size, created with default bounds if db_segment_size is 0
+    :return: taxonomy ids per read
+    """
+    t = time()
+    builder = MappedReadsBuilder()
+    filtered = 0
+    batcher = get_batcher(db_segment_size, batcher)
+    # group reads into chunks and map their accessions to taxons
+    for grouped_reads, acc2id, skipped in lookup_segments(batch_reads(reads, db_segment_size, batcher),
+                                                          flatten_accessions, megan_map_file, db_key, connection,
+                                                          accession_filter, db_threads, batcher):
+        filtered += skipped
+        # dechunk reads again
+        for read in grouped_reads:
+            builder.append([acc2id[acc] for acc in read if acc in acc2id])
+    mapped_reads = builder.build()
+    print_filtered(filtered, accession_filter)
+    print_batches(batcher)
+    print('mapped #reads: ' + str(len(mapped_reads)) + ' in ' + timer(t))
+    return mapped_reads
+
+
+def map_score_array(score_array: ScoreArray, megan_map_file: str, db_segment_size: int, db_key: str,
+                    connection: Optional[Connection] = None, accession_filter: Optional[BloomFilter] = None,
+                    db_threads: int = 0, batcher: Optional[AdaptiveBatcher] = None) -> MappedReads:
+    """
+    Retrieve taxonomy ids for every read in flat form from the Megan Map Database
+    and store them in one flat array with per-read offsets, no list is built per read.
+
+    :param score_array: accessions with scores and offsets per read
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param batcher: sizes chunks by distinct accessions and tunes them from measured lookups instead of
+        db_segment_size, created with default bounds if db_segment_size is 0
+    :return: taxonomy ids per read
+    """
+    t = time()
+    builder = MappedReadsBuilder()
+    filtered = 0
+    batcher = get_batcher(db_segment_size, batcher)
+    # map the accessions of consecutive ranges of reads to taxons
+    for segment, acc2id, skipped in lookup_segments(segment_score_array(score_array, db_segment_size, batcher),
+                                                    flatten_score_array, megan_map_file, db_key, connection,
+                                                    accession_filter, db_threads, batcher):
+        filtered += skipped
+        builder.extend([acc2id.get(acc) for acc in segment.accessions], segment.offsets)
+    mapped_reads = builder.build()
+    print_filtered(filtered, accession_filter)
+    print_batches(batcher)
+    print('mapped #reads: ' + str(len(mapped_reads)) + ' in ' + timer(t))
+    return mapped_reads
+
+
 def map_accessions_with_scores(reads_ws: List[List[Tuple[str, float]]],
-                               megan_map_file: str, db_segment_size: int, db_key: str) \
-        -> List[List[Tuple[int, float]]]:
+                               megan_map_file: str, db_segment_size: int, db_key: str,
+                               connection: Optional[Connection] = None, memory_budget: int = 0,
+                               accession_filter: Optional[BloomFilter] = None, db_threads: int = 0,
+                               batcher: Optional[AdaptiveBatcher] = None) -> List[List[Tuple[int, float]]]:
     """
     Retrieve taxonomy ids for every read from the Megan Map Database
 
     :param reads_ws: list of accessions with scores per read
     :param megan_map_file: path to file containing megan_map.db
-    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
     :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param memory_budget: maximum number of taxonomy ids held in memory before spilling to disk, 0 to disable
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently on a pool of connections, 0 to look up one at a time
+    :param batcher: sizes chunks by distinct accessions and tunes them from measured lookups instead of
+        db_segment_size, created with default bounds if db_segment_size is 0
     :return: list of taxonomy ids with scores per read
     """
     t = time()
-    mapped_reads_ws = []
-    # compute indices for segmentation
-    segments = [*range(0, len(reads_ws), db_segment_size), len(reads_ws)]
-    for i in range(1, len(segments)):
-        # group reads into chunks
-        grouped_reads_ws = reads_ws[segments[i - 1]:segments[i]]
-        # collect all accessions from a chunk of reads
-        flattened_reads = [acc for read_ws in grouped_reads_ws for acc, _ in read_ws]
-        # map accessions to taxons
-        acc2id = get_accessions2taxonids(megan_map_file, flattened_reads, db_key)
+    mapped_reads_ws = SpillList(memory_budget) if memory_budget else []
+    filtered = 0
+    batcher = get_batcher(db_segment_size, batcher)
+    # group reads into chunks and map their accessions to taxons
+    for grouped_reads_ws, acc2id, skipped in lookup_segments(batch_reads(reads_ws, db_segment_size, batcher,
+                                                                         read_accessions_ws),
+                                                             flatten_accessions_ws, megan_map_file, db_key,
+                                                             connection, accession_filter, db_threads, batcher):
+        filtered += skipped
         # dechunk reads again
         for read_ws in grouped_reads_ws:
             mapped_reads_ws.append([(acc2id[acc], score) for acc, score in read_ws if acc in acc2id])
+    print_filtered(filtered, accession_filter)
+    print_batches(batcher)
     print('mapped #reads: ' + str(len(reads_ws)) + ' in ' + timer(t))
     return mapped_reads_ws
 
 
+def map_accessions_multi(reads: Iterable[List[str]], megan_map_file: str, db_segment_size: int, db_keys: List[str],
+                         connection: Optional[Connection] = None, accession_filter: Optional[BloomFilter] = None,
+                         batcher: Optional[AdaptiveBatcher] = None) -> Dict[str, List[List[int]]]:
+    """
+    Retrieve ids of several keys for every read from the Megan Map Database with one query per segment
+
+    :param reads: list of accessions per read
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_keys: keys to map accessions to, e.g. ['Taxonomy', 'gtdb']
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting per segment
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param batcher: sizes chunks by distinct accessions and tunes them from measured lookups instead of
+        db_segment_size, created with default bounds if db_segment_size is 0
+    :return: list of ids per read for every key
+    """
+    t = time()
+    mapped_reads = {db_key: [] for db_key in db_keys}
+    filtered = 0
+    batcher = get_batcher(db_segment_size, batcher)
+    # group reads into chunks
+    for grouped_reads in batch_reads(reads, db_segment_size, batcher):
+        # collect the distinct accessions from a chunk of reads, every accession is probed and looked up once
+        flattened_reads, skipped = filter_accessions(list({acc for read in grouped_reads for acc in read}),
+                                                     accession_filter)
+        filtered += skipped
+        # map accessions to ids of all keys at once
+        acc2ids = {}
+        if flattened_reads:
+            start = perf_counter()
+            acc2ids = map_accessions2multiple_ids(connection, flattened_reads, db_keys) if connection \
+                else get_accessions2multiple_ids(megan_map_file, flattened_reads, db_keys)
+            if batcher:
+                batcher.record(len(flattened_reads), perf_counter() - start)
+        # dechunk reads again per key
+        for read in grouped_reads:
+            ids = [acc2ids[acc] for acc in read if acc in acc2ids]
+            for i, db_key in enumerate(db_keys):
+                mapped_reads[db_key].append([row[i] for row in ids if row[i] is not None])
+    print_filtered(filtered, accession_filter)
+    print_batches(batcher)
+    print('mapped #reads to #keys: ' + str(len(mapped_reads[db_keys[0]])) + ', ' + str(len(db_keys)) +
+          ' in ' + timer(t))
+    return mapped_reads
+
+
+def lookup_segments(segments: Iterable[List[Any]], flatten: Callable[[List[Any]], List[str]],
+                    megan_map_file: str, db_key: str, connection: Optional[Connection] = None,
+                    accession_filter: Optional[BloomFilter] = None, db_threads: int = 0,
+                    batcher: Optional[AdaptiveBatcher] = None) -> Iterator[Tuple[List[Any], Dict[str, int], int]]:
+    """
+    Map accessions of consecutive segments of reads to taxonomy ids in order of the segments.
+    With db_threads, segments are looked up concurrently on a pool of read-only connections
+    while at most twice as many segments as threads are held in memory.
+
+    :param segments: segments of reads
+    :param flatten: collects all accessions of a segment
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse if looked up one at a time
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param db_threads: number of segments looked up concurrently, 0 to look up one at a time
+    :param batcher: batcher the segments come from, receives the duration of every lookup
+    :return: generator of segments with their dictionary of accessions to taxonomy ids and number of skipped accessions
+    """
+    if db_threads < 1:
+        for segment in segments:
+            yield (segment, *lookup_batch(flatten(segment), megan_map_file, db_key, connection, accession_filter,
+                                          batcher))
+        return
+
+    with ConnectionPool(megan_map_file, db_threads) as pool, ThreadPoolExecutor(db_threads) as executor:
+
+        def lookup(segment: List[Any]) -> Tuple[Dict[str, int], int]:
+            with pool.acquire() as pooled:
+                return lookup_batch(flatten(segment), megan_map_file, db_key, pooled, accession_filter, batcher)
+
+        pending = deque()
+        for segment in segments:
+            pending.append((segment, executor.submit(lookup, segment)))
+            # bound the number of segments in flight, results are yielded in order
+            if len(pending) > 2 * db_threads:
+                segment, future = pending.popleft()
+                yield (segment, *future.result())
+        while pending:
+            segment, future = pending.popleft()
+            yield (segment, *future.result())
+
+
+def lookup_batch(accessions: List[str], megan_map_file: str, db_key: str, connection: Optional[Connection] = None,
+                 accession_filter: Optional[BloomFilter] = None, batcher: Optional[AdaptiveBatcher] = None) \
+        -> Tuple[Dict[str, int], int]:
+    """
+    Map a segment of accessions to taxonomy ids and report the duration to a batcher.
+    Every accession is probed and looked up once, so the duration is measured per distinct accession.
+
+    :param accessions: accessions of a segment of reads
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :param batcher: batcher to tune from the duration of the lookup, looked up as is if None
+    :return: dictionary of accessions to taxonomy ids, number of accessions skipped by the filter
+    """
+    accessions = list(set(accessions))
+    if batcher is None:
+        return lookup_accessions(accessions, megan_map_file, db_key, connection, accession_filter)
+    start = perf_counter()
+    acc2id, skipped = lookup_accessions(accessions, megan_map_file, db_key, connection, accession_filter)
+    batcher.record(len(accessions) - skipped, perf_counter() - start)
+    return acc2id, skipped
+
+
+def flatten_accessions(grouped_reads: List[List[str]]) -> List[str]:
+    """
+    :param grouped_reads: segment of accessions per read
+    :return: all accessions of the segment
+    """
+    return [acc for read in grouped_reads for acc in read]
+
+
+def flatten_score_array(segment: ScoreArray) -> List[str]:
+    """
+    :param segment: segment of reads in flat form
+    :return: all accessions of the segment
+    """
+    return segment.accessions
+
+
+def flatten_accessions_ws(grouped_reads_ws: List[List[Tuple[str, float]]]) -> List[str]:
+    """
+    :param grouped_reads_ws: segment of accessions with scores per read
+    :return: all accessions of the segment
+    """
+    return [acc for read_ws in grouped_reads_ws for acc, _ in read_ws]
+
+
+def lookup_accessions(accessions: List[str], megan_map_file: str, db_key: str,
+                      connection: Optional[Connection] = None, accession_filter: Optional[BloomFilter] = None) \
+        -> Tuple[Dict[str, int], int]:
+    """
+    Map a segment of accessions to taxonomy ids via the Megan Map Database
+
+    :param accessions: accessions of a segment of reads
+    :param megan_map_file: path to file containing megan_map.db
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param connection: open sqlite3 connection to megan_map.db to reuse instead of connecting
+    :param accession_filter: filter to skip accessions that are definitely missing from the database
+    :return: dictionary of accessions to taxonomy ids, number of accessions skipped by the filter
+    """
+    accessions, skipped = filter_accessions(accessions, accession_filter)
+    if not accessions:
+        return {}, skipped
+    if connection:
+        return map_accessions2ids(connection, accessions, db_key), skipped
+    return get_accessions2taxonids(megan_map_file, accessions, db_key), skipped
+
+
+def filter_accessions(accessions: List[str], accession_filter: Optional[BloomFilter]) -> Tuple[List[str], int]:
+    """
+    Remove accessions that are definitely missing from the database
+
+    :param accessions: accessions of a segment of reads
+    :param accession_filter: filter of the accessions of the database, nothing is removed if None
+    :return: accessions that may be in the database, number of removed accessions
+    """
+    if accession_filter is None or not accessions:
+        return accessions, 0
+    queried = [acc for acc, present in zip(accessions, accession_filter.contains(accessions).tolist()) if present]
+    return queried, len(accessions) - len(queried)
+
+
+def print_filtered(filtered: int, accession_filter: Optional[BloomFilter]):
+    """
+    Report the number of accessions that were not looked up because they are missing from the database
+
+    :param filtered: number of skipped accessions
+    :param accession_filter: filter that was used, nothing is reported if None
+    """
+    if accession_filter is not None:
+        print('skipped #accessions missing from database: ' + str(filtered))
+
+
+def load_megan_map_filter(megan_map_file: str) -> Optional[BloomFilter]:
+    """
+    Load the filter of accessions stored next to megan_map.db, see pygan.database.bloom to build it
+
+    :param megan_map_file: path to file containing megan_map.db
+    :return: filter or None if none was built
+    """
+    t = time()
+    accession_filter = load_accession_filter(megan_map_file)
+    if accession_filter is not None:
+        print('loaded accession filter in ' + timer(t))
+    return accession_filter
+
+
+def get_batcher(db_segment_size: int, batcher: Optional[AdaptiveBatcher] = None) -> Optional[AdaptiveBatcher]:
+    """
+    :param db_segment_size: number of reads per segment, 0 to size segments adaptively
+    :param batcher: batcher to use instead of segments of db_segment_size reads
+    :return: batcher or None if segments have a fixed number of reads
+    """
+    if batcher is None and db_segment_size < 1:
+        return AdaptiveBatcher()
+    return batcher
+
+
+def batch_reads(reads: Iterable[Any], db_segment_size: int, batcher: Optional[AdaptiveBatcher] = None,
+                read_accessions: Optional[Callable[[Any], Iterable[str]]] = None) -> Iterator[List[Any]]:
+    """
+    Group consecutive reads into segments of a fixed number of reads or adaptively sized by a batcher
+
+    :param reads: reads as list or spilled to disk
+    :param db_segment_size: number of reads per segment if no batcher is given
+    :param batcher: batcher sizing segments by distinct accessions
+    :param read_accessions: collects the accessions of a read, the read itself if None
+    :return: generator of segments of reads
+    """
+    if batcher:
+        return batcher.segments(reads, read_accessions)
+    return segment_reads(reads, db_segment_size)
+
+
+def read_accessions_ws(read_ws: List[Tuple[str, float]]) -> List[str]:
+    """
+    :param read_ws: accessions with scores of a read
+    :return: accessions of the read
+    """
+    return [acc for acc, _ in read_ws]
+
+
+def print_batches(batcher: Optional[AdaptiveBatcher]):
+    """
+    Report the number of adaptively sized segments and the size they were tuned to
+
+    :param batcher: batcher that was used, nothing is reported if None
+    """
+    if batcher is not None:
+        print('looked up #segments: ' + str(batcher.batches) + ', tuned to #accessions per segment: ' +
+              str(batcher.size))
+
+
+def segment_score_array(score_array: ScoreArray, db_segment_size: int,
+                        batcher: Optional[AdaptiveBatcher] = None) -> Iterator[ScoreArray]:
+    """
+    Group consecutive reads in flat form into segments of a fixed number of reads or adaptively sized by a batcher
+
+    :param score_array: accessions with scores and offsets per read
+    :param db_segment_size: number of reads per segment if no batcher is given
+    :param batcher: batcher sizing segments by distinct accessions
+    :return: generator of segments in flat form
+    """
+    offsets = score_array.offsets.tolist()
+    reads = len(offsets) - 1
+    if batcher:
+        spans = batcher.spans(score_array.accessions, offsets)
+    else:
+        spans = ((start, min(start + db_segment_size, reads)) for start in range(0, reads, db_segment_size))
+    for start, end in spans:
+        yield slice_score_array(score_array, start, end)
+
+
+def segment_reads(reads: Iterable[List[Any]], db_segment_size: int) -> Iterator[List[List[Any]]]:
+    """
+    Group consecutive reads into segments without requiring random access to the reads
+
+    :param reads: reads as list or spilled to disk
+    :param db_segment_size: number of reads per segment
+    :return: generator of segments of reads
+    """
+    segment = []
+    for read in reads:
+        segment.append(read)
+        if len(segment) == db_segment_size:
+            yield segment
+            segment = []
+    if segment:
+        yield segment
+
+
 def map_lcas(tree: PhyloTree, id2address: Dict, address2id: Dict,
-             reads: List[List[int]], read_ids: List[str], ignore_ancestors: bool):
+             reads: Iterable[List[int]], read_ids: List[str], ignore_ancestors: bool,
+             assignments: Optional[TextIO] = None, cache: Optional[LcaCache] = None) -> Set[int]:
     """
     Computes Lowest Common Ancestors for each read and maps it to the corresponding node in the phylogenetic tree
 
     :param tree: phylogenetic tree
     :param id2address: mapping of taxonomy id to its address in the tree
     :param address2id: mapping of a tree address to its taxonomy id
-    :param reads: list of taxonomy ids per read
-    :param read_ids: list of read ids corresponding to reads
+    :param reads: list of taxonomy ids per read, spilled to disk or compact
+    :param read_ids: list of read ids corresponding to reads, may be spilled to disk
     :param ignore_ancestors: use longest address or shortest address as reference
+    :param assignments: open text file to stream a read_id<TAB>tax_id line per read to as it is assigned
+    :param cache: memo of LCAs keyed by the taxons of a read, computed for every read if None
+    :return: taxonomy ids of nodes reads were mapped to
     """
     t = time()
     nodes = tree.nodes
-    # map each read to a taxon
-    for i, read in enumerate(reads):
+    occupied = set()
+    # map each read to a taxon, read ids may be spilled to disk and are only iterated
+    for read, read_id in zip(reads, read_ids):
         # by computing the common prefix on its mapped accessions
-        common_prefix = get_common_prefix([
-            id2address[taxonid] for taxonid in read
-            if taxonid in id2address
-        ], ignore_ancestors)
-        # map read
-        nodes[address2id[common_prefix]].reads.append(read_ids[i])
+        if cache:
+            tax_id = cache.get_lca(read, ignore_ancestors)
+        else:
+            tax_id = get_lca(read, id2address, address2id, ignore_ancestors)
+        nodes[tax_id].reads.append(read_id)
+        occupied.add(tax_id)
+        if assignments:
+            assignments.write(read_id + '\t' + str(tax_id) + '\n')
+    if cache:
+        print('memoized LCAs with hit rate: ' + str(round(cache.hit_rate, 3)))
     print('computed LCAs in ' + timer(t))
+    return occupied
+
+
+def post_process(tree: PhyloTree, occupied: Iterable[int], project_mode: str, project_rank: str,
+                 mapped_reads: Iterable[List[int]], read_ids: List[str], cluster_degree: int,
+                 min_support: int, exclude: List[str], only_major: bool, assignments: Optional[TextIO] = None):
+    """
+    Project reads to a rank and apply the minimum support filter on a working tree of only the occupied nodes,
+    their ancestors and, for accession projection, the taxa of mapped reads, so the cost of both scales with
+    the sample instead of the taxonomy. Results are moved back to the phylogenetic tree.
+
+    :param tree: phylogenetic tree with reads mapped by map_lcas
+    :param occupied: taxonomy ids of nodes reads were mapped to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param mapped_reads: list of potential taxons for each read, required by accession projection
+    :param read_ids: list of read ids, required by accession projection
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param min_support: minimum support limit nodes are required to satisfy
+    :param exclude: ranks that the filter should not be applied to
+    :param only_major: only major ranks are allowed to retain reads
+    :param assignments: open text file to stream the final taxonomy id of every post-processed read to
+    """
+    if not is_post_processed(project_mode, min_support, only_major):
+        return
+    working = post_process_pruned(tree, occupied, project_mode, project_rank, mapped_reads, read_ids,
+                                  cluster_degree, min_support, exclude, only_major)
+    if assignments:
+        stream_assignments(working, assignments)
+    restore(tree, working)
+
+
+def post_process_assignments(tree: PhyloTree, assignments: Dict[int, List[str]], mapped_reads: List[List[int]],
+                             read_ids: List[str], min_support: int, only_major: bool, exclude: List[str],
+                             project_mode: str, project_rank: str, cluster_degree: int,
+                             keep_reads: bool) -> LcaResult:
+    """
+    Project and filter reads assigned outside of the tree on a working tree, the tree is not modified,
+    so several samples can be post-processed on it at the same time
+
+    :param tree: phylogenetic tree
+    :param assignments: read ids per assigned taxonomy id
+    :param mapped_reads: list of potential taxons for each read, required by accession projection
+    :param read_ids: list of read ids, required by accession projection
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param keep_reads: keep read ids in the result, else only counts
+    :return: result of the post-processed reads
+    """
+    working = post_process_pruned(tree, assignments.keys(), project_mode, project_rank, mapped_reads, read_ids,
+                                  cluster_degree, min_support, exclude, only_major, assignments)
+    return LcaResult.from_tree(working, 'filtered', keep_reads)
+
+
+def post_process_pruned(tree: PhyloTree, occupied: Iterable[int], project_mode: str, project_rank: str,
+                        mapped_reads: Iterable[List[int]], read_ids: List[str], cluster_degree: int,
+                        min_support: int, exclude: List[str], only_major: bool,
+                        reads: Optional[Dict[int, List[str]]] = None) -> PhyloTree:
+    """
+    Prune the tree to the occupied nodes, their ancestors and, for accession projection, the taxa of mapped reads,
+    then project reads to a rank and apply the minimum support filter on the working tree
+
+    :param tree: phylogenetic tree
+    :param occupied: taxonomy ids of nodes reads were mapped to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param mapped_reads: list of potential taxons for each read, required by accession projection
+    :param read_ids: list of read ids, required by accession projection
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param min_support: minimum support limit nodes are required to satisfy
+    :param exclude: ranks that the filter should not be applied to
+    :param only_major: only major ranks are allowed to retain reads
+    :param reads: read ids per taxonomy id to post-process instead of the reads of the tree, which are moved
+        to the working tree if None, see prune
+    :return: working tree
+    """
+    t = time()
+    taxids = set(occupied)
+    # accession projection remaps reads to ancestors of their mapped taxa
+    if project_mode in ('accession', 'mixed'):
+        for read in mapped_reads:
+            taxids.update(read)
+    working = prune(tree, taxids, reads)
+    print('pruned tree to #nodes: ' + str(len(working.nodes)) + ' in ' + timer(t))
+    project_reads_to_rank(project_mode, working, project_rank, mapped_reads, read_ids, cluster_degree)
+    apply_min_sup_filter(working, min_support, exclude, only_major)
+    return working
+
+
+def is_post_processed(project_mode: str, min_support: int, only_major: bool) -> bool:
+    """
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param min_support: minimum support limit nodes are required to satisfy
+    :param only_major: only major ranks are allowed to retain reads
+    :return: whether post-processing may reassign reads after LCA assignment
+    """
+    return project_mode in ('proportional', 'accession', 'mixed') or min_support > 1 or only_major
 
 
 def apply_min_sup_filter(tree: PhyloTree, min_support: int, exclude: List[str], only_major: bool):
@@ -243,7 +1102,7 @@ def apply_min_sup_filter(tree: PhyloTree, min_support: int, exclude: List[str],
 
 
 def project_reads_to_rank(mode: str, tree: PhyloTree, rank: str,
-                          mapped_reads: List[List[int]], read_ids: List[str], cluster_degree: int):
+                          mapped_reads: Iterable[List[int]], read_ids: List[str], cluster_degree: int):
     """
     Attempt to project reads of nodes to only nodes with the target rank.
     Reads mapped below the target rank are pushed upwards.
@@ -252,7 +1111,7 @@ def project_reads_to_rank(mode: str, tree: PhyloTree, rank: str,
     :param mode: projection mode: proportional, accession or mixed
     :param tree: phylo tree
     :param rank: target rank for projection
-    :param mapped_reads: list of potential taxons for each read
+    :param mapped_reads: list of potential taxons for each read, spilled to disk or compact
     :param read_ids: list of read ids
     :param cluster_degree: degree of clustering of low level taxons
     """
@@ -268,6 +1127,37 @@ def project_reads_to_rank(mode: str, tree: PhyloTree, rank: str,
     print('projected reads to rank in ' + timer(t))
 
 
+def sweep_post_processing(tree: PhyloTree, configs: List[Dict[str, Any]],
+                          mapped_reads: Iterable[List[int]], read_ids: List[str],
+                          keep_reads: bool = False) -> List[LcaResult]:
+    """
+    Apply several post-processing configurations to the same LCA assignment.
+    The assignment is taken once and every configuration runs on its own working tree of the occupied nodes,
+    so the tree is never modified, even if a configuration fails, and no analysis needs to be repeated.
+
+    A configuration may contain the keys project_mode, project_rank, cluster_degree, min_support, exclude
+    and only_major, missing keys fall back to SWEEP_DEFAULTS.
+
+    :param tree: phylogenetic tree with reads mapped by map_lcas
+    :param configs: post-processing parameters per configuration
+    :param mapped_reads: list of potential taxons for each read, required by accession projection
+    :param read_ids: list of read ids, required by accession projection
+    :param keep_reads: keep read ids in the results, else only counts
+    :return: one result per configuration
+    """
+    t = time()
+    assignment = LcaResult.from_tree(tree, 'lca', keep_reads=True)
+    results = []
+    for config in configs:
+        params = {**SWEEP_DEFAULTS, **config}
+        results.append(post_process_assignments(tree, assignment.reads, mapped_reads, read_ids,
+                                                params['min_support'], params['only_major'], params['exclude'],
+                                                params['project_mode'], params['project_rank'],
+                                                params['cluster_degree'], keep_reads))
+    print('swept #configurations: ' + str(len(results)) + ' in ' + timer(t))
+    return results
+
+
 def write_results(tree: PhyloTree, out_file: str, prefix_rank: bool, show_path: bool, list_reads: bool):
     """
     Writes the results of the lca analysis to a file
@@ -279,12 +1169,167 @@ def write_results(tree: PhyloTree, out_file: str, prefix_rank: bool, show_path:
     :param list_reads: display read ids mapped to nodes (else display number of reads)
     """
     t = time()
-    result = [node.to_string(show_path, list_reads, prefix_rank) for node in tree.nodes.values() if node.reads]
+    result = format_results(tree, prefix_rank, show_path, list_reads)
     with open(out_file, 'w') as f:
         f.writelines(result)
     print('exported result in ' + timer(t))
 
 
+def write_assignments(tree: PhyloTree, out_file: str):
+    """
+    Writes the taxonomy id every read is mapped to, one read_id<TAB>tax_id line per read
+
+    :param tree: phylogenetic tree
+    :param out_file: path to output file
+    """
+    t = time()
+    with open(out_file, 'w') as f:
+        stream_assignments(tree, f)
+    print('exported assignments in ' + timer(t))
+
+
+def write_read_index(tree: PhyloTree, out_file: str):
+    """
+    Writes the read ids of the tree grouped by taxon in preorder, open the file with ReadIndex
+    to query the reads of a taxon or its subtree without loading the whole index
+
+    :param tree: phylogenetic tree
+    :param out_file: path to output file
+    """
+    t = time()
+    save_read_index(tree, out_file)
+    print('exported read index in ' + timer(t))
+
+
+def stream_assignments(tree: PhyloTree, assignments: TextIO):
+    """
+    Stream a read_id<TAB>tax_id line per read of a phylogenetic tree without joining reads of a node
+
+    :param tree: phylogenetic tree
+    :param assignments: open text file
+    """
+    for node in tree.nodes.values():
+        if node.reads:
+            tax_id = '\t' + str(node.tax_id) + '\n'
+            assignments.writelines(read_id + tax_id for read_id in node.reads)
+
+
+def summarize_tree(tree: PhyloTree) -> SubtreeSummary:
+    """
+    Compute cumulative read counts of every subtree of a phylogenetic tree in one pass
+
+    :param tree: phylogenetic tree with mapped reads
+    :return: summary answering reads at or below any taxon and counts per rank
+    """
+    t = time()
+    summary = SubtreeSummary(tree)
+    print('summarized tree in ' + timer(t))
+    return summary
+
+
+def write_rank_table(summary: SubtreeSummary, rank: str, out_file: str, prefix_rank: bool, show_path: bool):
+    """
+    Writes the number of reads at or below every node of a rank to a file
+
+    :param summary: summary of a phylogenetic tree
+    :param rank: rank such as 'genus'
+    :param out_file: path to output file
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    """
+    t = time()
+    with open(out_file, 'w') as f:
+        f.writelines(name + '\t' + str(count) + '\n'
+                     for name, count in summary.rank_table(rank, show_path, prefix_rank))
+    print('exported rank table in ' + timer(t))
+
+
+def write_estimates(tree: PhyloTree, estimates: Dict[int, Estimate], out_file: str, prefix_rank: bool,
+                    show_path: bool):
+    """
+    Writes the estimated number of reads of every sampled node with the bounds of its confidence interval
+    and the number of sampled reads, tab separated
+
+    :param tree: phylogenetic tree
+    :param estimates: estimate per taxonomy id
+    :param out_file: path to output file
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    """
+    t = time()
+    with open(out_file, 'w') as f:
+        for tax_id, node in tree.nodes.items():
+            if tax_id in estimates:
+                estimate = estimates[tax_id]
+                name = node.to_string(show_path, False, prefix_rank).split('\t')[0]
+                f.write(name + '\t' + '\t'.join(str(round(value)) for value in estimate[1:]) + '\t'
+                        + str(estimate.sampled) + '\n')
+    print('exported estimates in ' + timer(t))
+
+
+def format_results(tree: PhyloTree, prefix_rank: bool, show_path: bool, list_reads: bool) -> List[str]:
+    """
+    Formats the results of the lca analysis as lines of plain text
+
+    :param tree: phylogenetic tree
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param list_reads: display read ids mapped to nodes (else display number of reads)
+    :return: one line per node with mapped reads
+    """
+    return [node.to_string(show_path, list_reads, prefix_rank) for node in tree.nodes.values() if node.reads]
+
+
+def take_result(tree: PhyloTree, stage: str = 'lca', keep_reads: bool = False) -> LcaResult:
+    """
+    Take a compact, mergeable result of the reads mapped to a phylogenetic tree
+
+    :param tree: phylogenetic tree
+    :param stage: 'lca' if taken after LCA assignment, 'filtered' if taken after post-processing
+    :param keep_reads: keep read ids, else only counts
+    :return: result of the tree
+    """
+    return LcaResult.from_tree(tree, stage, keep_reads)
+
+
+def merge_results(results: Iterable[LcaResult]) -> LcaResult:
+    """
+    Merge results of the same stage, e.g. of chunks classified on different machines
+
+    :param results: results to merge
+    :return: merged result
+    """
+    t = time()
+    result = reduce(LcaResult.merge, results)
+    print('merged results in ' + timer(t))
+    return result
+
+
+def save_result(result: LcaResult, file: str):
+    """
+    Save result to a compressed file
+
+    :param result: result of an analysis
+    :param file: output file
+    """
+    t = time()
+    result.save(file)
+    print('saved result in ' + timer(t))
+
+
+def load_result(file: str) -> LcaResult:
+    """
+    Load result from a compressed file
+
+    :param file: file containing result
+    :return: result of an analysis
+    """
+    t = time()
+    result = LcaResult.load(file)
+    print('loaded result in ' + timer(t))
+    return result
+
+
 def save_to_bin(obj: Any, file: str):
     """
     Save object to binary file with pickle
@@ -0,0 +1,146 @@
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from typing import Dict, Tuple, List, Optional, Set
+
+from pygan.blast.sharding import compute_shards, parse_filter_range
+from pygan.database.megan_map import connect, disconnect
+from pygan.lca_analysis import parse_tree, get_batcher, batch_reads, lookup_segments, \
+    flatten_accessions, post_process, write_results, timer
+from pygan.tree.phylo_tree import PhyloTree
+from pygan.tree.shared import SharedTree
+
+# LCA index of a worker process, attached once per process by _init_worker
+_shared_tree: Optional[SharedTree] = None
+
+
+def run_sharded(tre_file: str, map_file: str, megan_map_file: str, blast_file: str,
+                blast_map: Dict[str, int], top_score_percent: float, db_segment_size: int, db_key: str,
+                ignore_ancestors: bool, min_support: int, only_major: bool, exclude: List[str],
+                project_mode: str, project_rank: str, cluster_degree: int,
+                out_file: str, prefix_rank: bool, show_path: bool, list_reads: bool, processes: int):
+    """
+    Performs an LCA analysis like run, but parses, maps and assigns reads of one blast file
+    in parallel processes. Output is identical to run.
+
+    :param tre_file: path to file containing phylogenetic tree
+    :param map_file: path to file containing mapping of taxonomy id to scientific name and rank
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param min_support: limit for the minimum support filter algorithm
+    :param only_major: only major ranks are allowed to retain reads
+    :param exclude: ranks that the minimum support filter should not be applied to
+    :param project_mode: method of read projection to a target rank ('accession', 'proportional', 'mixed', '')
+    :param project_rank: target rank to project reads to
+    :param cluster_degree: degree to cluster hits by during the accession-based projection
+    :param out_file: path to output file of results
+    :param prefix_rank: add an abbreviation of the rank to the name
+    :param show_path: show paths from root to nodes
+    :param list_reads: display read ids mapped to nodes (else display number of reads)
+    :param processes: number of shards and worker processes
+    """
+
+    print('starting sharded lca analysis')
+    lca_start = time()
+    tree = parse_tree(tre_file, map_file)
+    keep_mapped_reads = project_mode in ('accession', 'mixed')
+    mapped_reads, read_ids, occupied = map_lcas_sharded(tree, megan_map_file, blast_file, blast_map,
+                                                        top_score_percent, db_segment_size, db_key, ignore_ancestors,
+                                                        processes, keep_mapped_reads)
+    post_process(tree, occupied, project_mode, project_rank, mapped_reads, read_ids, cluster_degree,
+                 min_support, exclude, only_major)
+    write_results(tree, out_file, prefix_rank, show_path, list_reads)
+    print('completed sharded lca analysis in ' + timer(lca_start))
+
+
+def map_lcas_sharded(tree: PhyloTree, megan_map_file: str, blast_file: str, blast_map: Dict[str, int],
+                     top_score_percent: float, db_segment_size: int, db_key: str, ignore_ancestors: bool,
+                     processes: int, keep_mapped_reads: bool) \
+        -> Tuple[List[List[int]], List[str], Set[int]]:
+    """
+    Split a blast file into shards at read boundaries, parse, map and compute LCAs of every shard
+    in its own process and merge the assignments of all shards into the phylogenetic tree in file order.
+    Workers attach to an LCA index of the tree in shared memory instead of receiving a copy of the tree.
+
+    :param tree: phylogenetic tree
+    :param megan_map_file: path to file containing megan_map.db
+    :param blast_file: path to file containing blast data
+    :param blast_map: contains a mapping of which column qseqid, sseqid and bitscore are in
+    :param top_score_percent: percentage in [0, 1] to filter accessions by
+    :param db_segment_size: number of reads whose accessions are to be mapped via the database in chunks,
+        0 to size chunks adaptively
+    :param db_key: specific key to map accessions to (Taxonomy for NCBI, gtdb for GTDB)
+    :param ignore_ancestors: flag whether to ignore ancestors in the LCA algorithm
+    :param processes: number of shards and worker processes
+    :param keep_mapped_reads: return taxonomy ids and read ids of all reads, required by accession projection
+    :return: list of taxonomy ids per read, list of read ids (both empty unless kept),
+        taxonomy ids of nodes reads were mapped to
+    """
+    t = time()
+    shards = compute_shards(blast_file, processes, blast_map)
+    jobs = [(megan_map_file, blast_file, blast_map, top_score_percent, db_segment_size, db_key, ignore_ancestors,
+             start, end, keep_mapped_reads) for start, end in shards]
+    nodes = tree.nodes
+    mapped_reads = []
+    read_ids = []
+    occupied = set()
+    shared_tree = SharedTree.publish(tree)
+    try:
+        with ProcessPoolExecutor(max(1, len(jobs)), initializer=_init_worker, initargs=(shared_tree.name,)) as pool:
+            # map preserves the order of shards, so reads are merged in file order
+            for assignments, shard_mapped_reads, shard_read_ids in pool.map(classify_shard, jobs):
+                for tax_id, assigned in assignments.items():
+                    nodes[tax_id].reads += assigned
+                occupied.update(assignments)
+                mapped_reads += shard_mapped_reads
+                read_ids += shard_read_ids
+    finally:
+        shared_tree.unlink()
+    print('computed LCAs of #shards: ' + str(len(shards)) + ' in ' + timer(t))
+    return mapped_reads, read_ids, occupied
+
+
+def _init_worker(name: str):
+    """
+    Attach to the LCA index of the tree in a worker process
+
+    :param name: name of the shared memory block of the index
+    """
+    global _shared_tree
+    _shared_tree = SharedTree.attach(name)
+
+
+def classify_shard(job: Tuple) -> Tuple[Dict[int, List[str]], List[List[int]], List[str]]:
+    """
+    Parse, map and compute LCAs of the reads in one shard of a blast file
+
+    :param job: megan_map_file, blast_file, blast_map, top_score_percent, db_segment_size, db_key,
+        ignore_ancestors, start, end, keep_mapped_reads
+    :return: read ids per assigned taxonomy id, taxonomy ids per read and read ids if kept
+    """
+    megan_map_file, blast_file, blast_map, top_score_percent, db_segment_size, db_key, ignore_ancestors, \
+        start, end, keep_mapped_reads = job
+    reads, read_ids = parse_filter_range(blast_file, top_score_percent, blast_map, start, end)
+    mapped_reads = []
+    connection = connect(megan_map_file)
+    batcher = get_batcher(db_segment_size)
+    for grouped_reads, acc2id, _ in lookup_segments(batch_reads(reads, db_segment_size, batcher), flatten_accessions,
+                                                    megan_map_file, db_key, connection, batcher=batcher):
+        for read in grouped_reads:
+            mapped_reads.append([acc2id[acc] for acc in read if acc in acc2id])
+    disconnect(connection)
+    assignments = {}
+    for read, read_id in zip(mapped_reads, read_ids):
+        tax_id = _shared_tree.get_lca(read, ignore_ancestors)
+        if tax_id in assignments:
+            assignments[tax_id].append(read_id)
+        else:
+            assignments[tax_id] = [read_id]
+    if keep_mapped_reads:
+        return assignments, mapped_reads, read_ids
+    return assignments, [], []
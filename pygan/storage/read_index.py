@@ -0,0 +1,137 @@
+import mmap
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from pygan.tree.phylo_tree import PhyloTree
+from pygan.tree.prune import prune
+
+MAGIC = b'PYGANRI1'
+# magic, number of nodes, number of reads, bytes of read ids
+HEADER_BYTES = 32
+# arrays in order of the file, nodes are numbered in preorder of the tree pruned to the occupied nodes
+LAYOUT = (('taxids', 'q', 0), ('sorted_taxids', 'q', 0), ('node_offsets', 'q', 1), ('read_offsets', 'q', 1),
+          ('sorted_nodes', 'i', 0), ('exits', 'i', 0))
+ITEM_BYTES = {'q': 8, 'i': 4}
+
+
+def save_read_index(tree: PhyloTree, file: str):
+    """
+    Write the read ids of a tree grouped by taxon to an index file.
+
+    Only occupied nodes and their ancestors are stored, numbered in preorder, so the reads of the subtree
+    of any node are one contiguous slice of the file. Read ids are stored in the order of their nodes' reads.
+
+    :param tree: phylogenetic tree with mapped reads
+    :param file: output file
+    """
+    reads = {node.tax_id: node.reads for node in tree.nodes.values() if node.reads}
+    working = prune(tree, reads, reads)
+    working.compute_intervals()
+    preorder = working.preorder
+    taxids = np.array([node.tax_id for node in preorder], dtype=np.int64)
+    sorted_nodes = np.argsort(taxids, kind='stable').astype(np.int32)
+    node_offsets = np.zeros(len(preorder) + 1, dtype=np.int64)
+    np.cumsum([len(node.reads) for node in preorder], out=node_offsets[1:])
+    # every read id ends with a newline
+    encoded = [(read_id + '\n').encode() for node in preorder for read_id in node.reads]
+    read_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(read_id) for read_id in encoded], out=read_offsets[1:])
+    arrays = {'taxids': taxids, 'sorted_taxids': taxids[sorted_nodes], 'node_offsets': node_offsets,
+              'read_offsets': read_offsets, 'sorted_nodes': sorted_nodes,
+              'exits': np.array([node.exit for node in preorder], dtype=np.int32)}
+
+    with open(file, 'wb') as f:
+        f.write(MAGIC)
+        for count in (len(preorder), len(encoded), int(read_offsets[-1])):
+            f.write(count.to_bytes(8, 'little'))
+        for name, _, _ in LAYOUT:
+            f.write(arrays[name].tobytes())
+        f.writelines(encoded)
+
+
+class ReadIndex:
+    """
+    Read-only view of an index file written by save_read_index
+
+    The file is memory mapped, a query only touches the offsets of the taxon and the slice of its read ids.
+    """
+
+    def __init__(self, file: str):
+        """
+        :param file: index file
+        """
+        with open(file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if buffer[:8] != MAGIC:
+            buffer.release()
+            self._mmap.close()
+            raise ValueError(file + ' is not a read index')
+        self.size, self.total, blob_bytes = (int.from_bytes(buffer[i:i + 8], 'little') for i in (8, 16, 24))
+        offset = HEADER_BYTES
+        self._views = [buffer]
+        for name, code, extra in LAYOUT:
+            items = (self.total if name == 'read_offsets' else self.size) + extra
+            view = buffer[offset:offset + items * ITEM_BYTES[code]].cast(code)
+            self._views.append(view)
+            setattr(self, name, view)
+            offset += items * ITEM_BYTES[code]
+        self._blob_offset = offset
+
+    def node(self, taxid: int) -> Optional[int]:
+        """
+        :param taxid: taxonomy id
+        :return: preorder number of the node or None if no reads are at or below the taxon
+        """
+        i = bisect_left(self.sorted_taxids, taxid)
+        if i < self.size and self.sorted_taxids[i] == taxid:
+            return self.sorted_nodes[i]
+        return None
+
+    def count(self, taxid: int, subtree: bool = False) -> int:
+        """
+        :param taxid: taxonomy id
+        :param subtree: count the reads of all nodes at or below the taxon, else only of the taxon
+        :return: number of reads
+        """
+        start, end = self._span(taxid, subtree)
+        return end - start
+
+    def reads(self, taxid: int, subtree: bool = False) -> List[str]:
+        """
+        :param taxid: taxonomy id
+        :param subtree: return the reads of all nodes at or below the taxon in preorder, else only of the taxon
+        :return: read ids
+        """
+        start, end = self._span(taxid, subtree)
+        if start == end:
+            return []
+        blob = self._blob_offset
+        data = self._mmap[blob + self.read_offsets[start]:blob + self.read_offsets[end]]
+        return data.decode().split('\n')[:-1]
+
+    def _span(self, taxid: int, subtree: bool) -> Tuple[int, int]:
+        """
+        :return: range of reads of the taxon or its subtree
+        """
+        node = self.node(taxid)
+        if node is None:
+            return 0, 0
+        return self.node_offsets[node], self.node_offsets[self.exits[node] if subtree else node + 1]
+
+    def close(self):
+        """
+        Unmap the file
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self) -> 'ReadIndex':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
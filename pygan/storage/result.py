@@ -0,0 +1,120 @@
+import gzip
+import json
+from typing import Dict, List, Optional
+
+from pygan.tree.phylo_tree import PhyloTree
+
+# stages a result can be taken at, results of different stages can not be merged
+STAGES = ('lca', 'filtered')
+
+
+class LcaResult:
+    """
+    Compact, serializable result of an LCA analysis
+
+    Contains the number of reads per taxonomy id and optionally their read ids.
+    Results of the same stage can be merged, e.g. results of chunks classified on different machines.
+    Post-processing should be applied once to the merged result of stage 'lca'.
+    """
+
+    def __init__(self, counts: Dict[int, int], reads: Optional[Dict[int, List[str]]] = None, stage: str = 'lca'):
+        """
+        :param counts: number of reads per taxonomy id
+        :param reads: read ids per taxonomy id, None if only counts are kept
+        :param stage: 'lca' if taken after LCA assignment, 'filtered' if taken after post-processing
+        """
+        if stage not in STAGES:
+            raise ValueError('Unknown stage ' + stage)
+        self.counts = counts
+        self.reads = reads
+        self.stage = stage
+
+    @classmethod
+    def from_tree(cls, tree: PhyloTree, stage: str = 'lca', keep_reads: bool = False) -> 'LcaResult':
+        """
+        Take the result of a phylogenetic tree with mapped reads
+
+        :param tree: phylogenetic tree
+        :param stage: 'lca' if taken after LCA assignment, 'filtered' if taken after post-processing
+        :param keep_reads: keep read ids, else only counts
+        :return: result of the tree
+        """
+        occupied = [node for node in tree.nodes.values() if node.reads]
+        counts = {node.tax_id: len(node.reads) for node in occupied}
+        reads = {node.tax_id: list(node.reads) for node in occupied} if keep_reads else None
+        return cls(counts, reads, stage)
+
+    @property
+    def total(self) -> int:
+        """
+        :return: total number of reads
+        """
+        return sum(self.counts.values())
+
+    def merge(self, other: 'LcaResult') -> 'LcaResult':
+        """
+        Merge two results into a new one. Merging is associative.
+        Read ids are only kept if both results contain them.
+
+        :param other: result of the same stage
+        :return: merged result
+        """
+        if self.stage != other.stage:
+            raise ValueError('Can not merge results of stage ' + self.stage + ' and ' + other.stage)
+        counts = dict(self.counts)
+        for tax_id, count in other.counts.items():
+            counts[tax_id] = counts.get(tax_id, 0) + count
+        reads = None
+        if self.reads is not None and other.reads is not None:
+            reads = {tax_id: list(read_ids) for tax_id, read_ids in self.reads.items()}
+            for tax_id, read_ids in other.reads.items():
+                if tax_id in reads:
+                    reads[tax_id] += read_ids
+                else:
+                    reads[tax_id] = list(read_ids)
+        return LcaResult(counts, reads, self.stage)
+
+    def to_tree(self, tree: PhyloTree):
+        """
+        Replace the reads of a phylogenetic tree with this result.
+        Without read ids, nodes receive anonymous ('') reads, which suffices for the minimum support filter
+        and proportional projection, but not for accession projection or listing reads.
+
+        :param tree: phylogenetic tree with the taxonomy the result was taken from
+        """
+        tree.clear_reads()
+        nodes = tree.nodes
+        for tax_id, count in self.counts.items():
+            if tax_id not in nodes:
+                raise KeyError('Taxonomy id ' + str(tax_id) + ' of result is not in tree')
+            nodes[tax_id].reads = list(self.reads[tax_id]) if self.reads is not None else [''] * count
+
+    def save(self, file: str):
+        """
+        Save result to a gzip compressed json file
+
+        :param file: output file
+        """
+        data = {'stage': self.stage, 'counts': [[tax_id, count] for tax_id, count in self.counts.items()]}
+        if self.reads is not None:
+            data['reads'] = [[tax_id, read_ids] for tax_id, read_ids in self.reads.items()]
+        with gzip.open(file, 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, file: str) -> 'LcaResult':
+        """
+        Load result from a gzip compressed json file
+
+        :param file: file written by save
+        :return: result
+        """
+        with gzip.open(file, 'rt') as f:
+            data = json.load(f)
+        counts = {tax_id: count for tax_id, count in data['counts']}
+        reads = {tax_id: read_ids for tax_id, read_ids in data['reads']} if 'reads' in data else None
+        return cls(counts, reads, data['stage'])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LcaResult) and self.stage == other.stage and self.counts == other.counts \
+            and self.reads == other.reads
@@ -0,0 +1,110 @@
+import os
+from pickle import dump, load, HIGHEST_PROTOCOL
+from tempfile import mkstemp
+from typing import List, Any, Iterator, Optional
+
+
+class SpillList:
+    """
+    Append-only list of reads that holds at most a budget of hits in memory
+
+    Once the budget is exceeded, the buffered reads are written to a temporary segment file.
+    Iterating merges the segments back in order, loading only one segment at a time.
+    """
+
+    def __init__(self, memory_budget: int, directory: Optional[str] = None):
+        """
+        :param memory_budget: maximum number of hits buffered in memory before spilling to disk
+        :param directory: directory for segment files, system default if None
+        """
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self._buffer: List[Any] = []
+        self._buffered_hits = 0
+        self._segments: List[str] = []
+        self._length = 0
+
+    def append(self, read: List[Any]):
+        """
+        Append a read and spill the buffer if the memory budget is exceeded
+
+        :param read: list of hits of a read
+        """
+        self._buffer.append(read)
+        self._buffered_hits += self._weight(read)
+        self._length += 1
+        if self._buffered_hits > self.memory_budget:
+            self.spill()
+
+    def _weight(self, read: List[Any]) -> int:
+        """
+        :param read: list of hits of a read
+        :return: number of hits the read counts against the memory budget
+        """
+        # count the read itself so reads without hits are accounted for too
+        return len(read) + 1
+
+    def extend(self, reads: List[List[Any]]):
+        """
+        :param reads: reads to append
+        """
+        for read in reads:
+            self.append(read)
+
+    def spill(self):
+        """
+        Write buffered reads to a new segment file and clear the buffer
+        """
+        if not self._buffer:
+            return
+        fd, path = mkstemp(suffix='.spill', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            dump(self._buffer, f, HIGHEST_PROTOCOL)
+        self._segments.append(path)
+        self._buffer = []
+        self._buffered_hits = 0
+
+    def close(self):
+        """
+        Remove all segment files and buffered reads
+        """
+        for path in self._segments:
+            if os.path.exists(path):
+                os.remove(path)
+        self._segments = []
+        self._buffer = []
+        self._buffered_hits = 0
+        self._length = 0
+
+    @property
+    def spilled_segments(self) -> int:
+        """
+        :return: number of segments written to disk
+        """
+        return len(self._segments)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        for path in self._segments:
+            with open(path, 'rb') as f:
+                segment = load(f)
+            yield from segment
+        yield from self._buffer
+
+    def __del__(self):
+        self.close()
+
+
+class SpillIds(SpillList):
+    """
+    Append-only list of read ids that holds at most a budget of read ids in memory
+    """
+
+    def _weight(self, read_id: str) -> int:
+        """
+        :param read_id: read id
+        :return: every read id counts as one hit
+        """
+        return 1
@@ -1,4 +1,44 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+
+
+class ReadCount:
+    """
+    Number of reads mapped to a node in place of the list of their ids
+
+    Supports the list operations that move reads between nodes, so reads can be counted,
+    projected and filtered in constant memory per node. Read ids can not be iterated.
+    """
+
+    def __init__(self, count: int = 0):
+        """
+        :param count: number of reads
+        """
+        self.count = count
+
+    def append(self, read_id: str):
+        """
+        :param read_id: read id, only counted
+        """
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iadd__(self, reads: Union[List[str], 'ReadCount']) -> 'ReadCount':
+        self.count += len(reads)
+        return self
+
+    def __getitem__(self, key: slice) -> 'ReadCount':
+        return ReadCount(len(range(*key.indices(self.count))))
+
+    def __setitem__(self, key: slice, reads: Union[List[str], 'ReadCount']):
+        self.count += len(reads) - len(range(*key.indices(self.count)))
+
+    def __iter__(self):
+        raise TypeError('only the number of reads is kept, not their ids')
 
 
 class PhyloNode:
@@ -7,6 +47,7 @@ class PhyloNode:
 
     Contains a tax_id, name, rank, path from root, pointer to its parent, list of children and
     and reads indicates the number of reads mapped to this node or is a list of their ids.
+    Entry and exit delimit the node's subtree in the preorder of the tree once computed.
     """
 
     def __init__(self):
@@ -16,9 +57,11 @@ class PhyloNode:
         self.rank: Optional[str] = None
         self.path: Optional[str] = None
         self.path_with_rank: Optional[str] = None
-        self.reads: List[str] = []
+        self.reads: Union[List[str], ReadCount] = []
         self.parent: Optional[PhyloNode] = None
         self.children: List[PhyloNode] = []
+        self.entry: Optional[int] = None
+        self.exit: Optional[int] = None
 
     def to_string(self, show_path: bool, list_reads: bool, show_rank: bool):
         """
@@ -45,7 +88,8 @@ class PhyloTree:
     """
     Primitive phylogenetic tree
 
-    Contains only pointer to its root and tax_id to node map
+    Contains only pointer to its root and tax_id to node map,
+    and the nodes in preorder once subtree intervals are computed
     """
 
     _RANK_ABBREV: Dict[Optional[str], str] = {
@@ -67,13 +111,34 @@ class PhyloTree:
     def __init__(self):
         self.root: Optional[PhyloNode] = None
         self.nodes: Dict[int, PhyloNode] = {}
+        self.preorder: Optional[List[PhyloNode]] = None
 
-    def clear_reads(self):
+    def clear_reads(self, count_only: bool = False):
         """
         Remove all mapped reads from the tree
+
+        :param count_only: keep only the number of reads mapped to every node from now on instead of their ids
         """
         for node in self.nodes.values():
-            node.reads.clear()
+            node.reads = ReadCount() if count_only else []
+
+    def compute_intervals(self):
+        """
+        Number nodes in preorder. The subtree of a node occupies preorder[node.entry:node.exit].
+        """
+        preorder = []
+        if self.root:
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                node.entry = len(preorder)
+                preorder.append(node)
+                # reversed, so the first child is visited first
+                stack.extend(reversed(node.children))
+            # a subtree ends where the subtree of the last child ends
+            for node in reversed(preorder):
+                node.exit = node.children[-1].exit if node.children else node.entry + 1
+        self.preorder = preorder
 
     def completed_mapping(self):
         """
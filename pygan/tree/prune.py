@@ -0,0 +1,66 @@
+from typing import Iterable, Dict, List, Optional
+
+from pygan.tree.phylo_tree import PhyloTree, PhyloNode
+
+
+def prune(tree: PhyloTree, taxids: Iterable[int], reads: Optional[Dict[int, List[str]]] = None) -> PhyloTree:
+    """
+    Build a working tree of only the nodes of a set of taxa and their ancestors.
+    Children keep their order and the root is always kept, so algorithms traversing the working tree
+    visit nodes in the same order as in the full tree. Reads are moved from the full tree to the working tree,
+    use restore to move them back. If reads are given instead, the full tree is not modified.
+
+    :param tree: phylogenetic tree with mapped reads
+    :param taxids: taxonomy ids to keep, e.g. of occupied nodes, ids missing from the tree are ignored
+    :param reads: read ids per taxonomy id to place on the working tree instead of the reads of the full tree
+    :return: working tree
+    """
+    pruned = PhyloTree()
+    if tree.root is None:
+        return pruned
+    nodes = tree.nodes
+    kept: Dict[int, PhyloNode] = {tree.root.tax_id: tree.root}
+    # climb until a node that was already kept
+    for taxid in taxids:
+        node = nodes.get(taxid)
+        while node is not None and node.tax_id not in kept:
+            kept[node.tax_id] = node
+            node = node.parent
+
+    copies = {}
+    for taxid, node in kept.items():
+        copy = PhyloNode()
+        copy.tax_id = node.tax_id
+        copy.name = node.name
+        copy.name_with_rank = node.name_with_rank
+        copy.rank = node.rank
+        copy.path = node.path
+        copy.path_with_rank = node.path_with_rank
+        if reads is None:
+            copy.reads = node.reads
+            node.reads = []
+        else:
+            copy.reads = list(reads.get(taxid, ()))
+        copies[taxid] = copy
+    for taxid, node in kept.items():
+        copy = copies[taxid]
+        if node.parent is not None:
+            copy.parent = copies[node.parent.tax_id]
+        copy.children = [copies[child.tax_id] for child in node.children if child.tax_id in copies]
+
+    pruned.root = copies[tree.root.tax_id]
+    pruned.nodes = copies
+    return pruned
+
+
+def restore(tree: PhyloTree, pruned: PhyloTree):
+    """
+    Move the reads of a working tree back to the full tree it was pruned from
+
+    :param tree: phylogenetic tree the working tree was pruned from
+    :param pruned: working tree
+    """
+    nodes = tree.nodes
+    for taxid, copy in pruned.nodes.items():
+        nodes[taxid].reads = copy.reads
+        copy.reads = []
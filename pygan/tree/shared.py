@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Optional
+
+import numpy as np
+
+from pygan.tree.phylo_tree import PhyloTree
+
+# number of nodes stored in front of the arrays
+HEADER_BYTES = 8
+# arrays per node in order of the block, nodes are numbered in preorder
+LAYOUT = (('taxids', 'q'), ('sorted_taxids', 'q'), ('sorted_nodes', 'i'), ('parents', 'i'), ('depths', 'i'),
+          ('exits', 'i'))
+ITEM_BYTES = {'q': 8, 'i': 4}
+
+
+class SharedTree:
+    """
+    Read-only LCA index of a phylogenetic tree in a block of shared memory
+
+    Nodes are numbered in preorder. Every node has its taxonomy id, parent, depth and the end of its subtree,
+    taxonomy ids are looked up in a sorted copy. Worker processes attach to the block by its name
+    without copying or unpickling the tree, so memory and startup cost do not grow with the number of workers.
+    Computes the same lowest common ancestors as get_lca on LCA addresses.
+    """
+
+    def __init__(self, memory: SharedMemory, owner: bool):
+        """
+        :param memory: block written by publish
+        :param owner: whether the block is unlinked on unlink
+        """
+        self.memory = memory
+        self.owner = owner
+        self.size = int.from_bytes(bytes(memory.buf[:HEADER_BYTES]), 'little')
+        offset = HEADER_BYTES
+        self._views = []
+        for name, code in LAYOUT:
+            nbytes = self.size * ITEM_BYTES[code]
+            view = memory.buf[offset:offset + nbytes].cast(code)
+            self._views.append(view)
+            setattr(self, name, view)
+            offset += nbytes
+
+    @property
+    def name(self) -> str:
+        """
+        :return: name to attach to the block
+        """
+        return self.memory.name
+
+    @classmethod
+    def publish(cls, tree: PhyloTree) -> 'SharedTree':
+        """
+        Write the LCA index of a tree to a new block of shared memory.
+        The caller owns the block and has to unlink it once all workers are done.
+
+        :param tree: phylogenetic tree
+        :return: shared tree
+        """
+        tree.compute_intervals()
+        preorder = tree.preorder
+        size = len(preorder)
+        taxids = np.array([node.tax_id for node in preorder], dtype=np.int64)
+        parents = [node.parent.entry if node.parent else -1 for node in preorder]
+        depths = [0] * size
+        # parents precede their children in preorder
+        for i in range(1, size):
+            depths[i] = depths[parents[i]] + 1
+        parents = np.array(parents, dtype=np.int32)
+        depths = np.array(depths, dtype=np.int32)
+        exits = np.array([node.exit for node in preorder], dtype=np.int32)
+        sorted_nodes = np.argsort(taxids, kind='stable').astype(np.int32)
+        arrays = {'taxids': taxids, 'sorted_taxids': taxids[sorted_nodes], 'sorted_nodes': sorted_nodes,
+                  'parents': parents, 'depths': depths, 'exits': exits}
+
+        memory = SharedMemory(create=True, size=HEADER_BYTES + size * sum(ITEM_BYTES[code] for _, code in LAYOUT))
+        memory.buf[:HEADER_BYTES] = size.to_bytes(HEADER_BYTES, 'little')
+        offset = HEADER_BYTES
+        for name, code in LAYOUT:
+            nbytes = size * ITEM_BYTES[code]
+            memory.buf[offset:offset + nbytes] = arrays[name].tobytes()
+            offset += nbytes
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedTree':
+        """
+        Attach to a block published by another process
+
+        :param name: name of the block
+        :return: shared tree
+        """
+        return cls(SharedMemory(name=name), False)
+
+    def node(self, taxid: int) -> Optional[int]:
+        """
+        :param taxid: taxonomy id
+        :return: preorder number of the node or None if the taxon is not in the tree
+        """
+        i = bisect_left(self.sorted_taxids, taxid)
+        if i < self.size and self.sorted_taxids[i] == taxid:
+            return self.sorted_nodes[i]
+        return None
+
+    def get_lca(self, taxids: Iterable[int], ignore_ancestors: bool = False) -> int:
+        """
+        Compute the lowest common ancestor of the taxons of a read
+
+        :param taxids: taxonomy ids of a read, ids missing in the tree are ignored
+        :param ignore_ancestors: ignore taxons that are ancestors of the deepest taxon
+        :return: taxonomy id of the lowest common ancestor
+        """
+        nodes = [node for node in map(self.node, taxids) if node is not None]
+        if not nodes:
+            return self.taxids[0]
+        parents = self.parents
+        exits = self.exits
+        if ignore_ancestors:
+            # climb from the first deepest node until it covers every node that is not its ancestor
+            depths = self.depths
+            lca = max(nodes, key=lambda node: depths[node])
+            others = [node for node in nodes if not node <= lca < exits[node]]
+        else:
+            # the lowest common ancestor covers the first and last node in preorder
+            lca = min(nodes)
+            others = [max(nodes)]
+        for node in others:
+            while not lca <= node < exits[lca]:
+                lca = parents[lca]
+        return self.taxids[lca]
+
+    def close(self):
+        """
+        Detach from the block
+        """
+        for view in self._views:
+            view.release()
+        self._views = []
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Detach from the block and free it if this process published it
+        """
+        self.close()
+        if self.owner:
+            self.memory.unlink()
+